@@ -1,6 +1,12 @@
 import { WS_BASE_URL, API_URL, ENDPOINTS } from './constants';
 import type { GenerationRequest, TokenChunk, CacheSaveRequest, CacheLoadRequest, TrimCacheRequest, CacheResponse } from './types';
 
+const frameDecoder = new TextDecoder();
+
+// The backend sends pre-encoded JSON as binary frames; accept text frames too.
+const decodeFrame = (data: string | ArrayBuffer): string =>
+  typeof data === 'string' ? data : frameDecoder.decode(data);
+
 export class GenerationStreamManager {
   private ws: WebSocket | null = null;
   private request: GenerationRequest | null = null;
@@ -33,6 +39,7 @@ export class GenerationStreamManager {
 
     try {
         this.ws = new WebSocket(wsUrl);
+        this.ws.binaryType = 'arraybuffer';
     } catch (error) {
         this.onErrorCallback(new Error(`Failed to establish WebSocket: ${error instanceof Error ? error.message : String(error)}`));
         return;
@@ -60,17 +67,21 @@ export class GenerationStreamManager {
 
     this.ws.onmessage = (event) => {
       try {
-        const chunk = JSON.parse(event.data as string) as TokenChunk;
-        if (chunk.error) {
-          this.onErrorCallback(new Error(chunk.error));
-          this.receivedFinalChunk = true;
-          this.closeStream("Error received from backend");
-          return;
-        }
-        this.onTokenCallback(chunk);
-        if (chunk.is_finished) {
-          this.receivedFinalChunk = true;
-          this.onCompleteCallback();
+        // A frame carries either a single chunk or an array of coalesced chunks.
+        const payload = JSON.parse(decodeFrame(event.data)) as TokenChunk | TokenChunk[];
+        const chunks = Array.isArray(payload) ? payload : [payload];
+        for (const chunk of chunks) {
+          if (chunk.error) {
+            this.onErrorCallback(new Error(chunk.error));
+            this.receivedFinalChunk = true;
+            this.closeStream("Error received from backend");
+            return;
+          }
+          this.onTokenCallback(chunk);
+          if (chunk.is_finished) {
+            this.receivedFinalChunk = true;
+            this.onCompleteCallback();
+          }
         }
       } catch (error) {
         this.onErrorCallback(new Error(`Failed to parse server response: ${error instanceof Error ? error.message : String(error)}`));
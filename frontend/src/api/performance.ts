@@ -1,6 +1,15 @@
 import { WS_BASE_URL, API_URL, ENDPOINTS } from './constants';
 import type { PerformanceMetrics } from './types';
 
+const frameDecoder = new TextDecoder();
+
+// The backend stamps samples in Unix epoch seconds.
+const epochSecondsToDate = (seconds: number): Date => new Date(seconds * 1000);
+
+// Metrics arrive as pre-encoded JSON in binary frames; accept text frames too.
+const decodeFrame = (data: string | ArrayBuffer): string =>
+  typeof data === 'string' ? data : frameDecoder.decode(data);
+
 export const fetchPerformanceStats = async (): Promise<PerformanceMetrics | null> => {
   try {
     const response = await fetch(ENDPOINTS.PERFORMANCE.STATS, { cache: 'no-store' });
@@ -9,7 +18,7 @@ export const fetchPerformanceStats = async (): Promise<PerformanceMetrics | null
       return null;
     }
     const data = await response.json();
-    return { ...data, timestamp: new Date(data.timestamp) } as PerformanceMetrics;
+    return { ...data, timestamp: epochSecondsToDate(data.timestamp) } as PerformanceMetrics;
   } catch (error) {
     console.error('Error fetching performance stats:', error);
     return null;
@@ -21,6 +30,7 @@ export class PerformanceStreamManager {
   private onMetricsCallback: (metrics: PerformanceMetrics) => void;
   private onErrorCallback: (error: Error) => void;
   private onCompleteCallback?: () => void;
+  private onSnapshotCallback?: (history: PerformanceMetrics[]) => void;
   private reconnectAttempts: number = 0;
   private readonly maxReconnectAttempts: number = 5;
   private readonly initialReconnectDelay: number = 3000;
@@ -30,11 +40,13 @@ export class PerformanceStreamManager {
   constructor(
     onMetrics: (metrics: PerformanceMetrics) => void,
     onError: (error: Error) => void,
-    onComplete?: () => void
+    onComplete?: () => void,
+    onSnapshot?: (history: PerformanceMetrics[]) => void
   ) {
     this.onMetricsCallback = onMetrics;
     this.onErrorCallback = onError;
     this.onCompleteCallback = onComplete;
+    this.onSnapshotCallback = onSnapshot;
     this.connect();
   }
 
@@ -47,20 +59,30 @@ export class PerformanceStreamManager {
 
     try {
         this.ws = new WebSocket(wsUrl);
+        this.ws.binaryType = 'arraybuffer';
     } catch (error) {
         this.handleConnectionError(new Error(`Failed to create WebSocket: ${error instanceof Error ? error.message : String(error)}`));
         return;
     }
 
-    this.ws.onopen = () => {
-      this.reconnectAttempts = 0;
-    };
-
     this.ws.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data as string);
-        if (data && data.timestamp) {
-          const metrics: PerformanceMetrics = { ...data, timestamp: new Date(data.timestamp) };
+        const data = JSON.parse(decodeFrame(event.data));
+        if (data && data.type === 'snapshot') {
+          // Sent once on connect: the server's retained history, oldest first.
+          const history: PerformanceMetrics[] = (data.data || []).map(
+            (sample: any) => ({ ...sample, timestamp: epochSecondsToDate(sample.timestamp) })
+          );
+          if (this.onSnapshotCallback) {
+            this.onSnapshotCallback(history);
+          } else if (history.length) {
+            this.onMetricsCallback(history[history.length - 1]);
+          }
+        } else if (data && data.timestamp) {
+          // Reset backoff only once the stream actually delivers; a server that accepts and then
+          // closes with 1011 would otherwise be retried at the minimum delay forever.
+          this.reconnectAttempts = 0;
+          const metrics: PerformanceMetrics = { ...data, timestamp: epochSecondsToDate(data.timestamp) };
           this.onMetricsCallback(metrics);
         } else if (data && data.error) {
             this.onErrorCallback(new Error(data.error));
@@ -9,6 +9,7 @@ export interface ModelInfo {
     config?: Record<string, any> | null;
     is_loaded: boolean;
     adapter_path?: string | null;
+    is_unloading?: boolean;
 }
 
 export interface ModelLoadRequest {
@@ -61,6 +62,9 @@ export interface GenerationParams {
     
     kv_cache_options?: KVCacheOptions | null;
     logit_bias?: Record<string, number> | null;
+
+    stream_batch_size?: number | null;
+    stream_flush_interval_ms?: number | null;
 }
 
 // GenerationRequest to backend will require either prompt or messages
@@ -103,13 +107,16 @@ export interface CacheResponse {
 
 export interface MemoryUsage {
     rss_mb: number;
+    gpu_active_mb?: number | null;
+    peak_mb?: number | null;
 }
 
 export interface PerformanceMetrics {
-    timestamp: Date; // Will be string from JSON, convert to Date on frontend
+    timestamp: Date; // Unix epoch seconds in the JSON, converted to Date on the frontend
     tokens_per_second?: number | null;
     memory_usage?: MemoryUsage | null;
     cpu_usage_percent?: number | null;
+    sample_interval_ms?: number | null; // Streamed samples only; the server slows down when idle
 }
 
 export interface ConfigUpdateRequest {
@@ -57,6 +57,12 @@ export const usePerformanceStore = defineStore('performance', () => {
       () => { // onComplete (WebSocket closed)
         isStreaming.value = false;
         streamManager = null;
+      },
+      (history: PerformanceMetrics[]) => { // onSnapshot: the backend's history replaces ours
+        historicalMetrics.value = history.slice(-maxHistory);
+        if (history.length) {
+          currentMetrics.value = history[history.length - 1];
+        }
       }
     );
   }
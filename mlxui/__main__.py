@@ -2,8 +2,14 @@ import os
 import sys
 import time
 import signal
+import asyncio
+import contextlib
 import subprocess
 import argparse
+import hashlib
+import importlib.util
+import json
+import socket
 import threading
 from pathlib import Path
 from typing import Optional
@@ -21,38 +27,123 @@ except NameError:
 if str(PROJECT_DIR) not in sys.path:
     sys.path.insert(0, str(PROJECT_DIR))
 
+FRONTEND_READY_TIMEOUT_S = 30
+FRONTEND_INSTALL_TIMEOUT_S = 300
+VITE_READY_MARKERS = ("ready in", "Local:")
+LOCK_HASH_MARKER = ".mlxui_lock_hash"
+FRONTEND_PORT = 3000  # Matches server.port in frontend/vite.config.ts
+FRONTEND_STATE_FILE = PROJECT_DIR / ".mlxui-frontend.json"
+FRONTEND_LOG_FILE = PROJECT_DIR / ".mlxui-frontend.log"
+
 frontend_process: Optional[subprocess.Popen] = None
-stop_event = threading.Event()
+# False when the dev server is shared across runs (--reuse-frontend) and must outlive this one.
+frontend_owned = True
+frontend_ready = threading.Event()
+installing = False
 
-def signal_handler(sig, frame):
+def _terminate_frontend(timeout: float = 5):
     global frontend_process
-    print("\n[mlxui __main__] Signal received, initiating shutdown...", flush=True)
+    if not frontend_owned:
+        frontend_process = None
+        return
+    if frontend_process:
+        _clear_frontend_state(frontend_process.pid)
     if frontend_process and frontend_process.poll() is None:
         print("[mlxui __main__] Terminating frontend process...", flush=True)
         frontend_process.terminate()
         try:
-            frontend_process.wait(timeout=5)
+            frontend_process.wait(timeout=timeout)
             print("[mlxui __main__] Frontend process terminated.", flush=True)
         except subprocess.TimeoutExpired:
             print("[mlxui __main__] Frontend process did not terminate gracefully, killing.", flush=True)
             frontend_process.kill()
             frontend_process.wait()
             print("[mlxui __main__] Frontend process killed.", flush=True)
-        frontend_process = None
-    stop_event.set()
-    print("[mlxui __main__] Shutdown signal processed. Uvicorn should now exit.", flush=True)
+    frontend_process = None
+
+class _BackendServer(uvicorn.Server):
+    """uvicorn server that leaves SIGINT/SIGTERM to the launcher's event loop handlers."""
+
+    def install_signal_handlers(self) -> None:  # uvicorn < 0.29
+        pass
+
+    @contextlib.contextmanager
+    def capture_signals(self):  # uvicorn >= 0.29
+        yield
+
+async def _serve_backend(config: uvicorn.Config):
+    server = _BackendServer(config)
+    shutdown_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def _on_signal():
+        if shutdown_requested.is_set():
+            # Second Ctrl+C: stop waiting on open connections.
+            server.force_exit = True
+            return
+        print("\n[mlxui __main__] Signal received, initiating shutdown...", flush=True)
+        shutdown_requested.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, _on_signal)
+
+    async def _shutdown_on_signal():
+        await shutdown_requested.wait()
+        await asyncio.to_thread(_terminate_frontend)
+        server.should_exit = True
+
+    shutdown_task = asyncio.create_task(_shutdown_on_signal())
+    try:
+        await server.serve()
+    finally:
+        shutdown_task.cancel()
+        await asyncio.gather(shutdown_task, return_exceptions=True)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+
+def _server_impls() -> dict:
+    """Pick uvloop/httptools when installed, falling back to uvicorn's pure-Python defaults.
+
+    WebSockets use uvicorn's auto-selected implementation with a larger write buffer.
+    """
+    loop_impl = "uvloop" if importlib.util.find_spec("uvloop") is not None else "asyncio"
+    http_impl = "httptools" if importlib.util.find_spec("httptools") is not None else "h11"
+    if loop_impl != "uvloop" or http_impl != "httptools":
+        print(f"[mlxui __main__] uvloop/httptools not fully available; using loop={loop_impl}, http={http_impl}.", flush=True)
+    impls = {"loop": loop_impl, "http": http_impl}
+    from mlxui.ws_protocol import WideBufferWebSocketProtocol
+    if WideBufferWebSocketProtocol is not None:
+        impls["ws"] = WideBufferWebSocketProtocol
+    return impls
 
 def start_backend(host: str, port: int, reload: bool):
     print(f"[mlxui __main__] Starting backend server on http://{host}:{port}...", flush=True)
+    impls = _server_impls()
     try:
-        uvicorn.run(
-            "mlxui.backend.server:app",
-            host=host,
-            port=port,
-            reload=reload,
-            log_level="info",
-            reload_dirs=[str(PACKAGE_DIR / "backend")] if reload else None
-        )
+        if reload:
+            # The reloader supervises a child process, so let uvicorn own the process lifecycle.
+            uvicorn.run(
+                "mlxui.backend.server:app",
+                host=host,
+                port=port,
+                reload=True,
+                log_level="info",
+                reload_dirs=[str(PACKAGE_DIR / "backend")],
+                **impls,
+            )
+        else:
+            config = uvicorn.Config(
+                "mlxui.backend.server:app",
+                host=host,
+                port=port,
+                log_level="info",
+                **impls,
+            )
+            if impls["loop"] == "uvloop":
+                import uvloop
+                uvloop.run(_serve_backend(config))
+            else:
+                asyncio.run(_serve_backend(config))
         print("[mlxui __main__] Backend server has stopped.", flush=True)
     except SystemExit:
         print("[mlxui __main__] Backend server stopped via SystemExit.", flush=True)
@@ -60,15 +151,107 @@ def start_backend(host: str, port: int, reload: bool):
         print(f"[mlxui __main__] Import Error starting backend: {e}", file=sys.stderr, flush=True)
         print("This might happen if dependencies are missing or the project structure is incorrect.", file=sys.stderr, flush=True)
         print("Try running `pip install -e .` from the project root directory.", file=sys.stderr, flush=True)
-        stop_event.set()
         sys.exit(1)
     except Exception as e:
         print(f"[mlxui __main__] Error starting backend: {e}", file=sys.stderr, flush=True)
-        stop_event.set()
         sys.exit(1)
 
-def start_frontend_dev():
-    global frontend_process
+def _pump_frontend_output(proc: subprocess.Popen):
+    """Echo the dev server's output and flag readiness once Vite reports it is serving."""
+    assert proc.stdout is not None
+    for line in proc.stdout:
+        print(line, end="", flush=True)
+        if not frontend_ready.is_set() and any(marker in line for marker in VITE_READY_MARKERS):
+            frontend_ready.set()
+    # The process exited (or closed stdout); unblock anyone still waiting on readiness.
+    frontend_ready.set()
+
+def _echo_lines(stream, prefix: str = ""):
+    for line in stream:
+        print(f"{prefix}{line}", end="", flush=True)
+
+def _run_streaming(cmd: list, cwd: Path, timeout: float):
+    """Like subprocess.run(check=True, timeout=...), but echoes output as it arrives instead of buffering it."""
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=1,
+        text=True,
+    )
+    # Drain on a helper thread so a silent, hung npm still trips the timeout below.
+    reader = threading.Thread(target=_echo_lines, args=(proc.stdout, "[npm] "), daemon=True)
+    reader.start()
+    try:
+        returncode = proc.wait(timeout=max(0.0, timeout - (time.monotonic() - start)))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        reader.join(timeout=1)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+def _lockfile_hash(frontend_dir: Path) -> Optional[str]:
+    lock_path = frontend_dir / "package-lock.json"
+    if not lock_path.is_file():
+        return None
+    with open(lock_path, "rb") as f:
+        return hashlib.blake2b(f.read()).hexdigest()
+
+def _install_is_current(node_modules_path: Path, lock_hash: Optional[str]) -> bool:
+    """True when node_modules was installed from the current package-lock.json."""
+    if not node_modules_path.is_dir():
+        return False
+    if lock_hash is None:
+        # No lockfile to key on; fall back to the presence check.
+        return True
+    try:
+        return (node_modules_path / LOCK_HASH_MARKER).read_text(encoding="utf-8").strip() == lock_hash
+    except OSError:
+        return False
+
+def _frontend_listening(port: int = FRONTEND_PORT) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+def _read_frontend_state() -> Optional[dict]:
+    try:
+        return json.loads(FRONTEND_STATE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _write_frontend_state(pid: int, port: int = FRONTEND_PORT):
+    try:
+        FRONTEND_STATE_FILE.write_text(json.dumps({"pid": pid, "port": port}), encoding="utf-8")
+    except OSError as e:
+        print(f"[mlxui __main__] Could not record frontend pid: {e}", file=sys.stderr, flush=True)
+
+def _clear_frontend_state(pid: int):
+    state = _read_frontend_state()
+    if state and state.get("pid") == pid:
+        try:
+            FRONTEND_STATE_FILE.unlink()
+        except OSError:
+            pass
+
+def _wait_for_port(proc: subprocess.Popen, timeout: float):
+    """Readiness check for a detached dev server whose output goes to a log file."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        if _frontend_listening():
+            break
+        time.sleep(0.2)
+    frontend_ready.set()
+
+def _launch_frontend_dev(reuse: bool = False):
+    global frontend_process, frontend_owned, installing
     frontend_dir = PROJECT_DIR / "frontend"
     package_json_path = frontend_dir / "package.json"
     node_modules_path = frontend_dir / "node_modules"
@@ -77,57 +260,98 @@ def start_frontend_dev():
         print(f"[Error] Frontend 'package.json' not found at {package_json_path}. Cannot start frontend.", file=sys.stderr, flush=True)
         return
 
-    if not node_modules_path.is_dir():
-        print("[mlxui __main__] 'node_modules' not found. Running 'npm install' in frontend directory...", flush=True)
+    if reuse and _frontend_listening():
+        state = _read_frontend_state()
+        owner = f" (pid {state['pid']})" if state and state.get("port") == FRONTEND_PORT else ""
+        print(f"[mlxui __main__] Reusing frontend dev server at :{FRONTEND_PORT}{owner}.", flush=True)
+        frontend_owned = False
+        return
+
+    lock_hash = _lockfile_hash(frontend_dir)
+    if not _install_is_current(node_modules_path, lock_hash):
+        installing = True
+        # 'npm ci' installs straight from the lockfile without re-resolving the tree.
+        npm_install_cmd = ["npm", "ci"] if lock_hash is not None else ["npm", "install"]
+        npm_install_str = " ".join(npm_install_cmd)
+        print(f"[mlxui __main__] 'node_modules' missing or out of date with package-lock.json. Running '{npm_install_str}' in frontend directory...", flush=True)
         print("(This may take a few minutes...)", flush=True)
         try:
-            npm_install_cmd = ["npm", "install"]
-            print(f"[mlxui __main__] Executing: {' '.join(npm_install_cmd)} in {frontend_dir}", flush=True)
-            install_result = subprocess.run(
-                npm_install_cmd,
-                cwd=frontend_dir,
-                check=True,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
-            print("[mlxui __main__] npm install completed.", flush=True)
-            if install_result.stderr:
-                 print(f"[mlxui __main__] npm install stderr:\n{install_result.stderr}", flush=True)
+            print(f"[mlxui __main__] Executing: {npm_install_str} in {frontend_dir}", flush=True)
+            _run_streaming(npm_install_cmd, frontend_dir, FRONTEND_INSTALL_TIMEOUT_S)
+            print(f"[mlxui __main__] {npm_install_str} completed.", flush=True)
+            if lock_hash is not None:
+                try:
+                    (node_modules_path / LOCK_HASH_MARKER).write_text(lock_hash, encoding="utf-8")
+                except OSError as e:
+                    print(f"[mlxui __main__] Could not record lockfile hash: {e}", file=sys.stderr, flush=True)
         except FileNotFoundError:
             print("Error: 'npm' command not found. Please ensure Node.js and npm are installed and in your system's PATH.", file=sys.stderr, flush=True)
             return
         except subprocess.TimeoutExpired:
-            print("Error: 'npm install' timed out. Please check your network connection and try running it manually.", file=sys.stderr, flush=True)
+            print(f"Error: '{npm_install_str}' timed out. Please check your network connection and try running it manually.", file=sys.stderr, flush=True)
             return
         except subprocess.CalledProcessError as e:
-            print(f"Error during 'npm install' (return code {e.returncode}):", file=sys.stderr, flush=True)
-            print(f"stderr:\n{e.stderr}", flush=True)
-            print("Please run 'npm install' manually in the 'frontend' directory.", file=sys.stderr, flush=True)
+            print(f"Error during '{npm_install_str}' (return code {e.returncode}); see output above.", file=sys.stderr, flush=True)
+            print(f"Please run '{npm_install_str}' manually in the 'frontend' directory.", file=sys.stderr, flush=True)
             return
         except Exception as e:
-            print(f"An unexpected error occurred during npm install: {e}", file=sys.stderr, flush=True)
+            print(f"An unexpected error occurred during {npm_install_str}: {e}", file=sys.stderr, flush=True)
             return
+        finally:
+            installing = False
 
     print("[mlxui __main__] Starting frontend development server (npm run dev)...", flush=True)
     try:
         npm_start_cmd = ["npm", "run", "dev"]
         print(f"[mlxui __main__] Executing: {' '.join(npm_start_cmd)} in {frontend_dir}", flush=True)
-        frontend_process = subprocess.Popen(
-            npm_start_cmd,
-            cwd=frontend_dir,
-        )
-        time.sleep(5)
+        if reuse:
+            # Detach the server into its own session with output going to a log file,
+            # so it keeps serving after this run exits and the next run can adopt it.
+            with open(FRONTEND_LOG_FILE, "ab") as log_file:
+                frontend_process = subprocess.Popen(
+                    npm_start_cmd,
+                    cwd=frontend_dir,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+            frontend_owned = False
+            print(f"[mlxui __main__] Frontend output is written to {FRONTEND_LOG_FILE}", flush=True)
+            threading.Thread(
+                target=_wait_for_port, args=(frontend_process, FRONTEND_READY_TIMEOUT_S), daemon=True
+            ).start()
+        else:
+            frontend_process = subprocess.Popen(
+                npm_start_cmd,
+                cwd=frontend_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=1,
+                text=True,
+            )
+            threading.Thread(
+                target=_pump_frontend_output, args=(frontend_process,), daemon=True
+            ).start()
+        _write_frontend_state(frontend_process.pid)
+        frontend_ready.wait(timeout=FRONTEND_READY_TIMEOUT_S)
         if frontend_process.poll() is not None:
             print("Error: Frontend process terminated unexpectedly after start.", file=sys.stderr, flush=True)
+            _clear_frontend_state(frontend_process.pid)
             frontend_process = None
             return
-        print(f"[mlxui __main__] Frontend Dev Server presumed running. Access typically at: http://localhost:3000 (or Vite's configured port)", flush=True)
+        print(f"[mlxui __main__] Frontend Dev Server running. Access typically at: http://localhost:3000 (or Vite's configured port)", flush=True)
     except FileNotFoundError:
         print("Error: 'npm' command not found for starting frontend.", file=sys.stderr, flush=True)
     except Exception as e:
         print(f"Error starting frontend: {e}", file=sys.stderr, flush=True)
 
+def start_frontend_dev(reuse: bool = False):
+    try:
+        _launch_frontend_dev(reuse)
+    finally:
+        # Never leave main() waiting on a frontend that failed to come up.
+        frontend_ready.set()
+
 def main():
     parser = argparse.ArgumentParser(description="Run the mlxui application.")
     parser.add_argument(
@@ -139,36 +363,38 @@ def main():
     parser.add_argument(
         "--no-frontend", action="store_true", help="Do not start the frontend development server."
     )
+    parser.add_argument(
+        "--reuse-frontend",
+        action="store_true",
+        help=f"Adopt a frontend dev server already listening on port {FRONTEND_PORT}, and leave a newly started one running on exit.",
+    )
     parser.add_argument(
         "--reload", action="store_true", help="Enable auto-reload for the backend server (for development)."
     )
     args = parser.parse_args()
 
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-
     fe_thread = None
-    if not args.no_frontend:
-        fe_thread = threading.Thread(target=start_frontend_dev, daemon=True)
-        fe_thread.start()
-        print("[mlxui __main__] Waiting for frontend to initialize...", flush=True)
-        time.sleep(10 if not (PROJECT_DIR / "frontend" / "node_modules").is_dir() else 5)
-
     try:
+        if not args.no_frontend:
+            fe_thread = threading.Thread(target=start_frontend_dev, args=(args.reuse_frontend,), daemon=True)
+            fe_thread.start()
+            print("[mlxui __main__] Waiting for frontend to initialize...", flush=True)
+            # While 'npm install' runs the readiness timeout keeps getting extended,
+            # bounded by the install timeout itself.
+            deadline = time.monotonic() + FRONTEND_READY_TIMEOUT_S
+            while not frontend_ready.wait(timeout=max(0.0, deadline - time.monotonic())):
+                if not installing:
+                    print("[mlxui __main__] Frontend did not report ready in time; starting backend anyway.", flush=True)
+                    break
+                deadline = time.monotonic() + FRONTEND_READY_TIMEOUT_S
+
         start_backend(args.host, args.port, args.reload)
+    except KeyboardInterrupt:
+        # Only reachable before the backend loop takes over signal handling.
+        print("\n[mlxui __main__] Interrupted during startup.", flush=True)
     finally:
         print("[mlxui __main__] Backend has exited. Finalizing cleanup...", flush=True)
-        stop_event.set()
-
-        if frontend_process and frontend_process.poll() is None:
-            print("[mlxui __main__] Ensuring frontend process is terminated...", flush=True)
-            frontend_process.terminate()
-            try:
-                frontend_process.wait(timeout=3)
-            except subprocess.TimeoutExpired:
-                frontend_process.kill()
-                frontend_process.wait()
-            print("[mlxui __main__] Frontend process cleanup attempt complete.", flush=True)
+        _terminate_frontend(timeout=3)
 
         if fe_thread and fe_thread.is_alive():
              print("[mlxui __main__] Waiting for frontend thread to join...", flush=True)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Response, status
 import logging
 from typing import Dict, Any
 
@@ -11,19 +11,19 @@ logger = logging.getLogger("mlxui.backend.api.config_router") # Router specific
 @router.get("/", response_model=Dict[str, Any])
 async def get_app_configuration():
     logger.info("Request received: Get application configuration.")
-    # Return a copy to prevent direct modification of the internal config dict via reference
-    return app_config.get()
+    # Serve the cached JSON snapshot; it is only re-encoded after the config changes.
+    return Response(content=app_config.snapshot_bytes(), media_type="application/json")
 
 @router.post("/", response_model=ConfigUpdateResponse)
 async def update_app_configuration(request: ConfigUpdateRequest):
-    logger.info(f"Request received: Update configuration for key '{request.key}'.")
+    logger.info("Request received: Update configuration for key '%s'.", request.key)
     
-    # Basic validation (more complex validation could be added in Config.set)
+    # Basic validation (more complex validation could be added in Config.set/aset)
     if not request.key or not isinstance(request.key, str):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid configuration key provided.")
 
     # Attempt to set the configuration
-    success = app_config.set(request.key, request.value)
+    success = await app_config.aset(request.key, request.value)
 
     if success:
         return ConfigUpdateResponse(success=True, message=f"Configuration key '{request.key}' updated successfully.")
@@ -0,0 +1,18 @@
+"""
+Shared FastAPI dependencies for the API routers.
+"""
+from typing import NamedTuple
+
+from fastapi import Depends
+
+from mlxui.backend.core.mlx_adapter import MLXAdapter, get_mlx_adapter
+
+class AdapterState(NamedTuple):
+    adapter: MLXAdapter
+    available: bool
+    loaded: bool
+
+async def get_adapter_state(adapter: MLXAdapter = Depends(get_mlx_adapter)) -> AdapterState:
+    """Resolve the adapter and its availability/loaded flags once per request."""
+    available = adapter.is_available()
+    return AdapterState(adapter, available, available and adapter.is_model_loaded())
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, status
+import asyncio
 import logging
-import json
-from typing import AsyncIterator  # Ensure this is imported
+from contextlib import aclosing
 
-from mlxui.backend.core.mlx_adapter import MLXAdapter, get_mlx_adapter
+import orjson
+from pydantic import ValidationError
+
+from mlxui.backend.api.dependencies import AdapterState, get_adapter_state
+from mlxui.backend.api.performance import broadcaster as perf_broadcaster
 from mlxui.backend.api.schemas import (
     GenerationRequest,
     TokenChunk,
@@ -16,87 +20,177 @@ from mlxui.backend.api.schemas import (
 router = APIRouter()
 logger = logging.getLogger("mlxui.backend.api.generation")
 
+def _encode_chunk(chunk: TokenChunk) -> bytes:
+    # TokenChunk only holds JSON primitives, so its field dict can go straight to
+    # orjson; this skips pydantic's per-call serializer on the per-token path.
+    # Unset fields are left out rather than sent as null.
+    return orjson.dumps({k: v for k, v in chunk.__dict__.items() if v is not None})
+
+def _error_frame(message: str) -> bytes:
+    return _encode_chunk(TokenChunk(text="", is_finished=True, error=message, finish_reason="error"))
+
+# Static error frames, encoded once at import.
+_ERR_NO_MLX = _error_frame("mlx-lm library not available.")
+_ERR_NO_MODEL = _error_frame("No model loaded. Please load a model first.")
+_ERR_INVALID_JSON = _error_frame("Invalid JSON request.")
+
+# Requests larger than this are validated in a worker thread so long chat
+# histories do not stall other sockets on the event loop.
+VALIDATE_OFFLOAD_BYTES = 8 * 1024
+
+# Generation and socket writes run as producer/consumer around a bounded queue,
+# so a slow client never paces the model. The writer sends whatever has queued
+# up since its last send as one frame (a JSON array when it holds more than one
+# chunk). When the queue is full the producer folds new chunks into a pending
+# overflow chunk instead of waiting.
+STREAM_QUEUE_MAXSIZE = 64
+STREAM_BATCH_MAX_CHUNKS = 8
+
+def _encode_batch(chunks: list) -> bytes:
+    if len(chunks) == 1:
+        return _encode_chunk(chunks[0])
+    return b"[" + b",".join(_encode_chunk(c) for c in chunks) + b"]"
+
+def _merge_chunks(older: TokenChunk, newer: TokenChunk) -> TokenChunk:
+    """Fold two consecutive chunks into one without losing text."""
+    token_count = None
+    if older.token_count is not None or newer.token_count is not None:
+        token_count = (older.token_count or 0) + (newer.token_count or 0)
+    update = {"text": older.text + newer.text, "token_count": token_count}
+    # Counts are only sent on some chunks; keep the older chunk's where the newer one has none.
+    for name in ("prompt_tokens", "generation_tokens", "generation_tps"):
+        if getattr(newer, name) is None and getattr(older, name) is not None:
+            update[name] = getattr(older, name)
+    return newer.model_copy(update=update)
+
+async def _drain_stream(queue: asyncio.Queue, websocket: WebSocket) -> None:
+    """Writer task: send queued chunks until the None sentinel arrives."""
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        batch = [item]
+        done = False
+        while len(batch) < STREAM_BATCH_MAX_CHUNKS:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        await websocket.send_bytes(_encode_batch(batch))
+        if done:
+            return
+
+async def _put_while_writer_alive(queue: asyncio.Queue, item, writer: asyncio.Task) -> None:
+    """Blocking put that re-raises the writer's failure instead of waiting forever on a dead consumer."""
+    put = asyncio.ensure_future(queue.put(item))
+    await asyncio.wait({put, writer}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        await writer
+
 @router.websocket("/ws")
 async def websocket_generate_stream(
     websocket: WebSocket,
-    adapter: MLXAdapter = Depends(get_mlx_adapter)
+    state: AdapterState = Depends(get_adapter_state)
 ):
     await websocket.accept()
     logger.info("WebSocket connection established for generation stream.")
+    adapter = state.adapter
 
-    if not adapter.is_available():
-        error_chunk = TokenChunk(
-            text="",
-            is_finished=True,
-            error="mlx-lm library not available.",
-            finish_reason="error",
-        )
-        await websocket.send_text(error_chunk.model_dump_json())
+    if not state.available:
+        await websocket.send_bytes(_ERR_NO_MLX)
         await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
         return
-    if not adapter.is_model_loaded():
-        error_chunk = TokenChunk(text="", is_finished=True, error="No model loaded. Please load a model first.", finish_reason="error")
-        await websocket.send_text(error_chunk.model_dump_json())
+    if not state.loaded:
+        await websocket.send_bytes(_ERR_NO_MODEL)
         await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
         return
 
     try:
-        request_data_str = await websocket.receive_text()
-        request_data_dict = json.loads(request_data_str)
-        generation_request = GenerationRequest(**request_data_dict)
-
-        prompt_start_for_log = "N/A"
-        if generation_request.prompt:
-            prompt_start_for_log = generation_request.prompt[:50] + "..."
-        elif generation_request.messages:
-            first_user_message_content = "N/A"
-            for msg_dict in generation_request.messages:  # Iterate over list of dicts
-                # Pydantic model_dump might be better if messages are complex models
-                # but if they are simple dicts from JSON, .get() is fine.
-                if (
-                    isinstance(msg_dict, dict)
-                    and msg_dict.get("role") == "user"
-                    and msg_dict.get("content")
-                ):
-                    first_user_message_content = (
-                        str(msg_dict.get("content", ""))[:50] + "..."
-                    )
-                    break
-            prompt_start_for_log = (
-                f"Messages (first user: {first_user_message_content})"
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+        # Parse the frame as it arrived; text frames are re-encoded rather than
+        # round-tripped through str for json.loads.
+        raw_request = message.get("bytes") or message.get("text", "").encode()
+        request_data_dict = orjson.loads(raw_request)
+        try:
+            if len(raw_request) > VALIDATE_OFFLOAD_BYTES:
+                # run_in_executor rather than to_thread: validation reads no context
+                # variables, so copying the context for the worker thread is wasted.
+                generation_request = await asyncio.get_running_loop().run_in_executor(
+                    None, GenerationRequest.model_validate, request_data_dict
+                )
+            else:
+                generation_request = GenerationRequest.model_validate(request_data_dict)
+        except ValidationError as e:
+            logger.error("Invalid generation request received via WebSocket: %s", e)
+            await websocket.send_bytes(_error_frame(f"Invalid generation request: {e}"))
+            return
+
+        if logger.isEnabledFor(logging.INFO):
+            if generation_request.prompt:
+                prompt_start_for_log = generation_request.prompt[:50] + "..."
+            elif generation_request.messages:
+                first_user_message_content = next(
+                    (
+                        str(m["content"])[:50] + "..."
+                        for m in generation_request.messages
+                        if isinstance(m, dict) and m.get("role") == "user" and m.get("content")
+                    ),
+                    "N/A",
+                )
+                prompt_start_for_log = f"Messages (first user: {first_user_message_content})"
+            else:
+                prompt_start_for_log = "N/A"
+            logger.info(
+                "Generation request received via WebSocket. Input starts: '%s'", prompt_start_for_log
             )
-        logger.info(
-            f"Generation request received via WebSocket. Input starts: '{prompt_start_for_log}'"
-        )
 
-        async for chunk in adapter.stream_generate(generation_request):
-            await websocket.send_text(chunk.model_dump_json())
-            if chunk.is_finished and chunk.error:
-                logger.error(f"Error during generation stream: {chunk.error}")
-            elif chunk.is_finished:
-                logger.info(f"Generation stream finished successfully. Reason: {chunk.finish_reason}")
+        perf_broadcaster.notify_activity()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_MAXSIZE)
+        writer = asyncio.create_task(_drain_stream(queue, websocket))
+        try:
+            overflow = None
+            # Close the stream even when the client goes away mid-generation, so the adapter
+            # releases the model for queued requests now rather than whenever it's collected.
+            async with aclosing(adapter.stream_generate(generation_request)) as chunks:
+                async for chunk in chunks:
+                    if writer.done():
+                        await writer  # Client went away; surface the send error.
+                    if overflow is not None:
+                        chunk = _merge_chunks(overflow, chunk)
+                        overflow = None
+                    try:
+                        queue.put_nowait(chunk)
+                    except asyncio.QueueFull:
+                        overflow = chunk
+                    if chunk.is_finished and chunk.error:
+                        logger.error("Error during generation stream: %s", chunk.error)
+                    elif chunk.is_finished:
+                        logger.info("Generation stream finished successfully. Reason: %s", chunk.finish_reason)
+            if overflow is not None:
+                await _put_while_writer_alive(queue, overflow, writer)
+            await _put_while_writer_alive(queue, None, writer)
+            await writer
+        finally:
+            if not writer.done():
+                writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
 
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected by client during generation stream.")
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error("Invalid JSON received for generation request via WebSocket.")
-        error_chunk = TokenChunk(
-            text="",
-            is_finished=True,
-            error="Invalid JSON request.",
-            finish_reason="error",
-        )
-        await websocket.send_text(error_chunk.model_dump_json())
+        await websocket.send_bytes(_ERR_INVALID_JSON)
     except Exception as e:
         logger.exception("Unexpected error during WebSocket generation stream:")
-        error_chunk = TokenChunk(
-            text="",
-            is_finished=True,
-            error=f"Internal server error: {str(e)}",
-            finish_reason="error",
-        )
         try:
-            await websocket.send_text(error_chunk.model_dump_json())
+            await websocket.send_bytes(_error_frame(f"Internal server error: {str(e)}"))
         except Exception:
             pass
     finally:
@@ -110,18 +204,18 @@ async def websocket_generate_stream(
 @router.post("/cache/save", response_model=CacheResponse)
 async def save_cache_endpoint(
     request: CacheSaveRequest,
-    adapter: MLXAdapter = Depends(get_mlx_adapter)
+    state: AdapterState = Depends(get_adapter_state)
 ):
-    logger.info(f"Request to save KV cache to file: {request.filename}")
-    if not adapter.is_available():
+    logger.info("Request to save KV cache to file: %s", request.filename)
+    if not state.available:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="mlx-lm library not available.",
         )
-    if not adapter.is_model_loaded() or adapter.prompt_cache is None:
+    if not state.loaded or state.adapter.prompt_cache is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No active model or cache to save.")
     
-    success, message, cache_size = await adapter.save_kv_cache(request.filename)
+    success, message, cache_size = await state.adapter.save_kv_cache(request.filename)
     if not success:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=message)
     return CacheResponse(success=True, message=message, cache_size=cache_size)
@@ -130,15 +224,15 @@ async def save_cache_endpoint(
 @router.post("/cache/load", response_model=CacheResponse)
 async def load_cache_endpoint(
     request: CacheLoadRequest,
-    adapter: MLXAdapter = Depends(get_mlx_adapter)
+    state: AdapterState = Depends(get_adapter_state)
 ):
-    logger.info(f"Request to load KV cache from file: {request.filename}")
-    if not adapter.is_available():
+    logger.info("Request to load KV cache from file: %s", request.filename)
+    if not state.available:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="mlx-lm library not available.")
-    if not adapter.is_model_loaded():
+    if not state.loaded:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Load a model before loading a cache.")
 
-    success, message, cache_size = await adapter.load_kv_cache(request.filename)
+    success, message, cache_size = await state.adapter.load_kv_cache(request.filename)
     if not success:
         if "not found" in message.lower():
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message)
@@ -148,15 +242,15 @@ async def load_cache_endpoint(
 @router.post("/cache/trim", response_model=CacheResponse)
 async def trim_cache_endpoint(
     request: TrimCacheRequest,
-    adapter: MLXAdapter = Depends(get_mlx_adapter)
+    state: AdapterState = Depends(get_adapter_state)
 ):
-    logger.info(f"Request to trim {request.num_tokens} tokens from KV cache.")
-    if not adapter.is_available():
+    logger.info("Request to trim %s tokens from KV cache.", request.num_tokens)
+    if not state.available:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="mlx-lm library not available.")
-    if not adapter.is_model_loaded() or adapter.prompt_cache is None:
+    if not state.loaded or state.adapter.prompt_cache is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No active model or cache to trim.")
 
-    success, message, cache_size = await adapter.trim_kv_cache(request.num_tokens)
+    success, message, cache_size = await state.adapter.trim_kv_cache(request.num_tokens)
     if not success:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=message)
     return CacheResponse(success=True, message=message, cache_size=cache_size)
\ No newline at end of file
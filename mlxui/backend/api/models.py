@@ -1,29 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, status
 import logging
 from typing import List, Optional
-from mlxui.backend.core.mlx_adapter import MLXAdapter, get_mlx_adapter
-from mlxui.backend.api.schemas import GenerationRequest, TokenChunk, CacheSaveRequest, CacheLoadRequest, TrimCacheRequest, CacheResponse
+from mlxui.backend.api.dependencies import AdapterState, get_adapter_state
 from mlxui.backend.api.schemas import ModelInfo, ModelLoadRequest, ModelLoadResponse
 
 router = APIRouter()
 logger = logging.getLogger("mlxui.backend.api.models")
 
 @router.get("/", response_model=List[ModelInfo])
-async def list_models(adapter: MLXAdapter = Depends(get_mlx_adapter)): # Type hint with imported MLXAdapter
+async def list_models(state: AdapterState = Depends(get_adapter_state)):
     logger.info("Request received: List available local models.")
-    if not adapter.is_available():
+    if not state.available:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="MLX-LM library not available.")
+    adapter = state.adapter
     try:
         models = await adapter.list_local_models()
-        # Update is_loaded status based on current adapter state
-        current_loaded_id = adapter.current_identifier
-        for model_data in models:
-            if isinstance(model_data, dict): # Ensure it's a dict before modifying
-                 model_data['is_loaded'] = (model_data.get('id') == current_loaded_id)
-            elif isinstance(model_data, ModelInfo): # If it's already a Pydantic model
-                 model_data.is_loaded = (model_data.id == current_loaded_id)
-
-        return models
+        current_loaded_id = adapter.current_identifier if state.loaded else None
+        current_adapter_path = adapter.current_adapter_path
+        return [
+            ModelInfo(
+                **m,
+                is_loaded=m["id"] == current_loaded_id,
+                adapter_path=current_adapter_path if m["id"] == current_loaded_id else None,
+            )
+            for m in models
+        ]
     except Exception as e:
         logger.exception("Failed to list local models:")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to list models: {str(e)}")
@@ -31,37 +32,54 @@ async def list_models(adapter: MLXAdapter = Depends(get_mlx_adapter)): # Type hi
 @router.post("/load", response_model=ModelLoadResponse)
 async def load_model_endpoint(
     request: ModelLoadRequest,
-    adapter: MLXAdapter = Depends(get_mlx_adapter)
+    state: AdapterState = Depends(get_adapter_state)
 ):
-    logger.info(f"Request received: Load model identifier='{request.identifier}', adapter='{request.adapter_path}'")
-    if not adapter.is_available():
+    logger.info("Request received: Load model identifier='%s', adapter='%s'", request.identifier, request.adapter_path)
+    if not state.available:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="MLX-LM library not available.")
+    adapter = state.adapter
     try:
         result = await adapter.load_model(request.identifier, request.adapter_path)
         if result.get("success"):
-            loaded_model_info = await adapter.get_current_model_info()
+            loaded_model_info = result.get("model_info")
+            if loaded_model_info is None:
+                loaded_model_info = await adapter.get_current_model_info()
             return ModelLoadResponse(success=True, message=result.get("message", "Model loaded."), model_info=loaded_model_info)
         else:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result.get("message", "Failed to load model."))
     except FileNotFoundError as e: # Specifically catch this from adapter
-        logger.error(f"Model not found during load: {e}")
+        logger.error("Model not found during load: %s", e)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Model or adapter not found: {e}")
     except RuntimeError as e: # Catch runtime errors from adapter (e.g., load failure)
-        logger.error(f"Runtime error loading model: {e}")
+        logger.error("Runtime error loading model: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     except Exception as e:
-        logger.exception(f"Unexpected error loading model '{request.identifier}':")
+        logger.exception("Unexpected error loading model '%s':", request.identifier)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error: {str(e)}")
 
 @router.post("/unload", response_model=ModelLoadResponse)
-async def unload_model_endpoint(adapter: MLXAdapter = Depends(get_mlx_adapter)):
+async def unload_model_endpoint(
+    background_tasks: BackgroundTasks,
+    wait: bool = False,
+    state: AdapterState = Depends(get_adapter_state)
+):
     logger.info("Request received: Unload current model.")
-    if not adapter.is_available():
+    if not state.available:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="MLX-LM library not available.")
-    if not adapter.is_model_loaded():
+    adapter = state.adapter
+    if adapter.unload_in_progress and not wait:
+        return ModelLoadResponse(success=True, message="Unload already in progress.", model_info=None)
+    if not state.loaded:
         return ModelLoadResponse(success=True, message="No model currently loaded.", model_info=None)
-    
+
     unloaded_model_name = adapter.current_identifier or "Unknown"
+    if not wait:
+        # Releasing large models can take seconds; answer now and let /current report
+        # is_unloading until the memory has actually been freed.
+        adapter.begin_unload()
+        background_tasks.add_task(adapter.unload_model)
+        return ModelLoadResponse(success=True, message=f"Unload of model '{unloaded_model_name}' started.", model_info=None)
+
     success = await adapter.unload_model()
     if success:
         return ModelLoadResponse(success=True, message=f"Model '{unloaded_model_name}' unloaded successfully.", model_info=None)
@@ -70,14 +88,15 @@ async def unload_model_endpoint(adapter: MLXAdapter = Depends(get_mlx_adapter)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to unload model.")
 
 @router.get("/current", response_model=Optional[ModelInfo])
-async def get_current_model_endpoint(adapter: MLXAdapter = Depends(get_mlx_adapter)):
+async def get_current_model_endpoint(state: AdapterState = Depends(get_adapter_state)):
     logger.debug("Request received: Get current model info.")
-    if not adapter.is_available():
+    if not state.available:
         # Don't raise 503 if just checking, client might want to know if service is up but mlx-lm missing
         logger.warning("Attempted to get current model info, but mlx-lm library is not available.")
         return None
-    
-    model_info_dict = await adapter.get_current_model_info()
-    if model_info_dict:
-        return ModelInfo(**model_info_dict) # Convert dict from adapter to Pydantic model
-    return None
\ No newline at end of file
+    if state.adapter.unload_in_progress:
+        return state.adapter.unloading_model_info
+    if not state.loaded:
+        return None
+    # The adapter already returns a ModelInfo instance.
+    return await state.adapter.get_current_model_info()
\ No newline at end of file
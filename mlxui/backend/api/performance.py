@@ -1,35 +1,132 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, status
 import asyncio
+import ctypes
+import ctypes.util
 import logging
+import os
+import sys
+import time
+from collections import deque
+import mlx.core as mx
+import orjson
 import psutil # For system metrics
+from typing import Callable, Deque, Dict, Optional
 from mlxui.backend.core.mlx_adapter import MLXAdapter, get_mlx_adapter
-from mlxui.backend.api.schemas import PerformanceMetrics, MemoryUsage 
+from mlxui.backend.api.schemas import PerformanceMetrics
 from mlxui.backend.config import config as app_config 
-from datetime import datetime
 
 router = APIRouter()
 logger = logging.getLogger("mlxui.backend.api.performance")
 
 process = psutil.Process() # Get current process for memory usage
 
+# Per-client queue depth; samples beyond this replace the oldest queued one.
+PERF_CLIENT_QUEUE_SIZE = 2
+# A client whose socket has not accepted a sample for this long is disconnected.
+PERF_SEND_STALL_TIMEOUT_S = 10.0
+# Stream cadence: the configured interval (never below the floor) while a
+# generation is running or recently finished, the idle interval otherwise.
+PERF_MIN_INTERVAL_S = 1.0
+PERF_IDLE_INTERVAL_S = 5.0
+PERF_IDLE_AFTER_S = 30.0
+
+# Minimum spacing between real psutil reads; callers inside the window get the
+# cached value. cpu_percent() measures the delta since its previous call, so
+# sampling it more often than this mostly measures noise.
+CPU_SAMPLE_MIN_INTERVAL_S = 0.5
+RSS_SAMPLE_MIN_INTERVAL_S = 0.1
+# With Metal, tensor memory is reported by MLX directly; RSS misses it anyway,
+# so the Mach task_info call behind it only needs refreshing occasionally.
+RSS_SAMPLE_MIN_INTERVAL_METAL_S = 10.0
+
+METAL_AVAILABLE = mx.metal.is_available()
+# Newer MLX exposes the memory counters at top level and deprecates the mx.metal aliases.
+_mx_active_memory = getattr(mx, "get_active_memory", None) or mx.metal.get_active_memory
+_mx_peak_memory = getattr(mx, "get_peak_memory", None) or mx.metal.get_peak_memory
+_rss_interval_s = RSS_SAMPLE_MIN_INTERVAL_METAL_S if METAL_AVAILABLE else RSS_SAMPLE_MIN_INTERVAL_S
+
+def _statm_rss_reader() -> Callable[[], int]:
+    # Field 2 of statm is resident pages; the fd stays open so each read is one pread().
+    fd = os.open("/proc/self/statm", os.O_RDONLY)
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    return lambda: int(os.pread(fd, 128, 0).split()[1]) * page_size
+
+def _mach_rss_reader() -> Callable[[], int]:
+    class _TimeValue(ctypes.Structure):
+        _fields_ = [("seconds", ctypes.c_int32), ("microseconds", ctypes.c_int32)]
+
+    class _MachTaskBasicInfo(ctypes.Structure):
+        _fields_ = [
+            ("virtual_size", ctypes.c_uint64),
+            ("resident_size", ctypes.c_uint64),
+            ("resident_size_max", ctypes.c_uint64),
+            ("user_time", _TimeValue),
+            ("system_time", _TimeValue),
+            ("policy", ctypes.c_int32),
+            ("suspend_count", ctypes.c_int32),
+        ]
+
+    MACH_TASK_BASIC_INFO = 20
+    libc = ctypes.CDLL(ctypes.util.find_library("c"))
+    task = ctypes.c_uint32.in_dll(libc, "mach_task_self_").value  # what mach_task_self() expands to
+    task_info = libc.task_info
+    task_info.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint32)]
+    task_info.restype = ctypes.c_int
+    info = _MachTaskBasicInfo()
+    info_count = ctypes.sizeof(_MachTaskBasicInfo) // ctypes.sizeof(ctypes.c_uint32)
+
+    def read() -> int:
+        count = ctypes.c_uint32(info_count)
+        if task_info(task, MACH_TASK_BASIC_INFO, ctypes.byref(info), ctypes.byref(count)) != 0:
+            raise OSError("task_info(MACH_TASK_BASIC_INFO) failed")
+        return info.resident_size
+    return read
+
+def _make_rss_reader() -> Callable[[], int]:
+    """Cheapest available way to read this process's RSS in bytes; psutil if the direct read fails."""
+    factory = {"linux": _statm_rss_reader, "darwin": _mach_rss_reader}.get(sys.platform)
+    if factory is not None:
+        try:
+            reader = factory()
+            reader()  # Probe once so a broken reader falls back here rather than in the sampler
+            return reader
+        except Exception as e:
+            logger.debug("Direct RSS read unavailable (%s); using psutil.", e)
+    return lambda: process.memory_info().rss
+
+_read_rss = _make_rss_reader()
+_last_cpu = {"t": float("-inf"), "v": 0.0}
+_last_rss = {"t": float("-inf"), "v": 0.0}
+
+def _sample_metrics(adapter: MLXAdapter) -> dict:
+    """Gather current metrics as a plain dict shaped like PerformanceMetrics."""
+    now = time.monotonic()
+    if now - _last_rss["t"] >= _rss_interval_s:
+        _last_rss["t"], _last_rss["v"] = now, _read_rss() / (1024 * 1024)
+    if now - _last_cpu["t"] >= CPU_SAMPLE_MIN_INTERVAL_S:
+        _last_cpu["t"], _last_cpu["v"] = now, psutil.cpu_percent(interval=None) # Non-blocking
+
+    memory_usage = {"rss_mb": _last_rss["v"]}
+    if METAL_AVAILABLE:
+        memory_usage["gpu_active_mb"] = _mx_active_memory() / (1024 * 1024)
+        memory_usage["peak_mb"] = _mx_peak_memory() / (1024 * 1024)
+
+    return {
+        "timestamp": time.time(),
+        "tokens_per_second": adapter.last_generation_tps,
+        "memory_usage": memory_usage,
+        "cpu_usage_percent": _last_cpu["v"],
+    }
+
 def get_current_performance_metrics(adapter: MLXAdapter) -> PerformanceMetrics:
     """Helper function to gather current performance metrics."""
-    mem_info = process.memory_info()
-    rss_mb = mem_info.rss / (1024 * 1024)
-    
-    # TODO (Phase 3+): Explore more detailed MLX memory (if API exists)
-    # For now, process RSS is a good start.
-    # gpu_active_mb = mx.metal.get_active_memory() / (1024 * 1024) if hasattr(mx, 'metal') else None
-
-    memory_usage = MemoryUsage(rss_mb=rss_mb)
-    cpu_percent = psutil.cpu_percent(interval=None) # Non-blocking
-
-    return PerformanceMetrics(
-        timestamp=datetime.utcnow(),
-        tokens_per_second=adapter.last_generation_tps,
-        memory_usage=memory_usage,
-        cpu_usage_percent=cpu_percent,
-    )
+    return PerformanceMetrics(**_sample_metrics(adapter))
+
+def encode_performance_metrics(adapter: MLXAdapter, sample_interval_ms: Optional[int] = None) -> bytes:
+    """Fixed-shape stream payload, encoded directly instead of through a pydantic model."""
+    sample = _sample_metrics(adapter)
+    sample["sample_interval_ms"] = sample_interval_ms
+    return orjson.dumps(sample)
 
 @router.get("/stats", response_model=PerformanceMetrics)
 async def get_performance_stats_endpoint(adapter: MLXAdapter = Depends(get_mlx_adapter)):
@@ -40,6 +137,115 @@ async def get_performance_stats_endpoint(adapter: MLXAdapter = Depends(get_mlx_a
     return get_current_performance_metrics(adapter)
 
 
+class PerfBroadcaster:
+    """Samples metrics on one background task and fans each payload out to every connected client.
+
+    The sampler only runs while at least one client is subscribed, and backs off
+    to PERF_IDLE_INTERVAL_S when nothing has been generated for a while. The last
+    performance.history_size encoded samples are kept so a client that connects
+    late starts from the same history as the others (see snapshot_frame()).
+    """
+
+    def __init__(self):
+        self._clients: Dict[WebSocket, asyncio.Queue] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._latest: Optional[bytes] = None
+        self._last_active = float("-inf")
+        self._wake = asyncio.Event()
+        self.interval_s = self._base_interval_s(app_config.get("performance.update_interval_ms", 2000))
+        app_config.subscribe("performance.update_interval_ms", self._on_interval_change)
+        self._history: Deque[bytes] = deque(maxlen=self._history_size(app_config.get("performance.history_size", 120)))
+        app_config.subscribe("performance.history_size", self._on_history_size_change)
+
+    @staticmethod
+    def _base_interval_s(update_interval_ms) -> float:
+        try:
+            return max(PERF_MIN_INTERVAL_S, float(update_interval_ms) / 1000.0)
+        except (TypeError, ValueError):
+            return max(PERF_MIN_INTERVAL_S, 2.0)
+
+    def _on_interval_change(self, update_interval_ms) -> None:
+        self.interval_s = self._base_interval_s(update_interval_ms)
+        self._wake.set()  # Apply the new cadence now rather than after the old interval.
+
+    @staticmethod
+    def _history_size(history_size) -> int:
+        try:
+            return max(1, int(history_size))
+        except (TypeError, ValueError):
+            return 120
+
+    def _on_history_size_change(self, history_size) -> None:
+        self._history = deque(self._history, maxlen=self._history_size(history_size))
+
+    def snapshot_frame(self) -> bytes:
+        """The retained history as one {"type": "snapshot", "data": [...]} frame, spliced from the encoded samples."""
+        return b'{"type":"snapshot","data":[' + b",".join(self._history) + b"]}"
+
+    def notify_activity(self) -> None:
+        """Called when a generation starts: sample now and return to the active cadence."""
+        self._last_active = time.monotonic()
+        self._wake.set()
+
+    def subscribe(self, websocket: WebSocket, adapter: MLXAdapter) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=PERF_CLIENT_QUEUE_SIZE)
+        self._clients[websocket] = queue
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(adapter))
+        return queue
+
+    def unsubscribe(self, websocket: WebSocket) -> None:
+        self._clients.pop(websocket, None)
+        if not self._clients and self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._latest = None
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, payload: bytes) -> None:
+        # Samples are superseded by the next one, so a client that is behind gets the newest.
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(payload)
+
+    def _interval_s(self, adapter: MLXAdapter) -> float:
+        interval_s = self.interval_s
+        now = time.monotonic()
+        if adapter.generation_in_progress:
+            self._last_active = now
+        elif now - self._last_active > PERF_IDLE_AFTER_S:
+            interval_s = max(interval_s, PERF_IDLE_INTERVAL_S)
+        return interval_s
+
+    async def _run(self, adapter: MLXAdapter) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while self._clients:
+            self._wake.clear()
+            interval_s = self._interval_s(adapter)
+            # Schedule against a fixed timeline so sampling time doesn't push every later
+            # tick back; after a stall, a wake-up or a cadence change, restart it from now.
+            deadline += interval_s
+            if not 0 <= deadline - loop.time() <= interval_s:
+                deadline = loop.time() + interval_s
+            try:
+                if not adapter.available:
+                    adapter.last_generation_tps = None
+                self._latest = encode_performance_metrics(adapter, int(interval_s * 1000))
+                self._history.append(self._latest)
+                for queue in self._clients.values():
+                    self._offer(queue, self._latest)
+            except Exception:
+                logger.exception("Error sampling performance metrics:")
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            if self._wake.is_set():
+                deadline = loop.time()
+
+broadcaster = PerfBroadcaster()
+
 @router.websocket("/ws")
 async def websocket_performance_stream(
     websocket: WebSocket,
@@ -47,30 +253,38 @@ async def websocket_performance_stream(
 ):
     await websocket.accept()
     logger.info("Performance WebSocket connection established.")
-    
-    update_interval_ms = app_config.get("performance.update_interval_ms", 2000)
-    update_interval_s = max(0.5, update_interval_ms / 1000.0) # Ensure at least 0.5s
+    # Take the snapshot in the same step as subscribing, so every later sample
+    # reaches this client through its queue exactly once.
+    queue = broadcaster.subscribe(websocket, adapter)
+    snapshot = broadcaster.snapshot_frame()
+    close_code, close_reason = status.WS_1000_NORMAL_CLOSURE, ""
 
     try:
+        await asyncio.wait_for(websocket.send_bytes(snapshot), PERF_SEND_STALL_TIMEOUT_S)
+        # This loop is the client's only writer; the broadcaster never waits on a
+        # socket, so one slow client cannot hold up the others.
         while True:
-            if not adapter.is_available(): # Check periodically
-                 adapter.last_generation_tps = None
-            
-            metrics = get_current_performance_metrics(adapter)
-            await websocket.send_text(metrics.model_dump_json())
-            await asyncio.sleep(update_interval_s)
+            payload = await queue.get()
+            await asyncio.wait_for(websocket.send_bytes(payload), PERF_SEND_STALL_TIMEOUT_S)
             
     except WebSocketDisconnect:
         logger.info("Performance WebSocket disconnected by client.")
+    except asyncio.TimeoutError:
+        logger.warning("Performance WebSocket client stalled for %.0fs; disconnecting.", PERF_SEND_STALL_TIMEOUT_S)
     except Exception as e:
         logger.exception("Error in performance WebSocket stream:")
+        # 1011 tells the client this was a server fault rather than a network drop.
+        close_code, close_reason = status.WS_1011_INTERNAL_ERROR, "internal error"
         try:
-            await websocket.send_text(json.dumps({"error": str(e)}))
-        except:
+            await asyncio.wait_for(
+                websocket.send_bytes(orjson.dumps({"error": str(e)})), PERF_SEND_STALL_TIMEOUT_S
+            )
+        except Exception:
             pass # Ignore if sending error fails
     finally:
+        broadcaster.unsubscribe(websocket)
         try:
-            await websocket.close()
+            await asyncio.wait_for(websocket.close(code=close_code, reason=close_reason), PERF_SEND_STALL_TIMEOUT_S)
             logger.info("Performance WebSocket connection closed.")
-        except RuntimeError: # Already closed
-            pass
\ No newline at end of file
+        except (RuntimeError, asyncio.TimeoutError): # Already closed, or the peer is unresponsive
+            pass
@@ -5,11 +5,11 @@ These models define the data structures expected by the API endpoints.
 from pydantic import (
     BaseModel,
     Field,
-    root_validator,
     field_validator,
-)  # Add root_validator
+    model_validator,
+)
 from typing import List, Dict, Any, Optional, Union, Literal
-from datetime import datetime
+import time
 
 class ModelInfo(BaseModel):
     id: str = Field(..., description="Unique identifier (local path or Hub ID)")
@@ -19,6 +19,7 @@ class ModelInfo(BaseModel):
     config: Optional[Dict[str, Any]] = Field(None, description="Snippet of relevant model config (e.g., type, quantization)")
     is_loaded: bool = Field(False, description="Indicates if the model is currently loaded in the backend") # Default to False
     adapter_path: Optional[str] = Field(None, description="Path to loaded adapter, if any")
+    is_unloading: bool = Field(False, description="Indicates a background unload of this model is still releasing memory")
 
 class ModelLoadRequest(BaseModel):
     identifier: str = Field(..., description="Local path or Hugging Face Hub repository ID to load")
@@ -77,20 +78,19 @@ class GenerationRequest(BaseModel):
     kv_cache_options: Optional[KVCacheOptions] = Field(None)
     logit_bias: Optional[Dict[str, float]] = Field(None)
 
-    # Why: Root validator to ensure at least prompt or messages is provided.
-    @root_validator(
-        pre=False, skip_on_failure=True
-    )  # Pydantic v1 style, use model_validator for v2
-    @classmethod
-    def check_prompt_or_messages_present(cls, values: Dict[str, Any]) -> Dict[str, Any]:
-        prompt, messages = values.get("prompt"), values.get("messages")
-        if not prompt and not messages:
+    # Streaming granularity; None falls back to generation.stream_batch_size / stream_flush_interval_ms.
+    stream_batch_size: Optional[int] = Field(None, ge=1, description="Tokens handed to the stream at a time.")
+    stream_flush_interval_ms: Optional[float] = Field(
+        None, ge=0, description="Hand over a partial group once it has been waiting this long."
+    )
+
+    # Why: Model validator to ensure at least prompt or messages is provided.
+    # If both are given, messages win unless ignore_chat_template is set; the adapter decides.
+    @model_validator(mode="after")
+    def check_prompt_or_messages_present(self) -> "GenerationRequest":
+        if not self.prompt and not self.messages:
             raise ValueError("Either 'prompt' or 'messages' must be provided.")
-        if prompt and messages:
-            # As per current logic, messages will override prompt if ignore_chat_template is False
-            # This is fine, adapter will handle which one to use.
-            pass
-        return values
+        return self
 
     # Why: Pydantic validator for logit_bias keys
     @field_validator('logit_bias', mode='before')
@@ -100,15 +100,10 @@ class GenerationRequest(BaseModel):
             return None
         if not isinstance(v, dict):
             raise ValueError("logit_bias must be a dictionary.")
-        validated_bias: Dict[str, float] = {}
-        for key, value in v.items():
-            try:
-                str_key = str(key)
-                float_value = float(value)
-                validated_bias[str_key] = float_value
-            except ValueError:
-                raise ValueError(f"Invalid logit_bias: '{key}': '{value}'.")
-        return validated_bias
+        try:
+            return {str(key): float(value) for key, value in v.items()}
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid logit_bias entry: {e}")
 
 class TokenChunk(BaseModel):
     text: str = Field(..., description="The generated text segment in this chunk")
@@ -118,10 +113,12 @@ class TokenChunk(BaseModel):
     from_draft: Optional[bool] = Field(None, description="True if token(s) came from the draft model")
     token_count: Optional[int] = Field(None, description="Number of new tokens generated in this chunk (usually 1)")
     token: Optional[int] = Field(None, description="The token ID generated (from mlx-lm)")
-    prompt_tokens: Optional[int] = Field(None, description="Number of prompt tokens processed")
-    generation_tokens: Optional[int] = Field(None, description="Cumulative number of tokens generated so far in this stream")
+    prompt_tokens: Optional[int] = Field(None, description="Number of prompt tokens processed (first and final chunks only)")
+    generation_tokens: Optional[int] = Field(
+        None, description="Cumulative number of tokens generated so far in this stream (may be omitted on chunks sent in the same group as a later one)"
+    )
     generation_tps: Optional[float] = Field(
-        None, description="Overall generation tokens-per-second (from mlx-lm)"
+        None, description="Overall generation tokens-per-second (from mlx-lm; sent alongside generation_tokens)"
     )
 
 class CacheSaveRequest(BaseModel):
@@ -131,7 +128,7 @@ class CacheLoadRequest(BaseModel):
     filename: str = Field(..., min_length=1, description="Filename (without path) of the cache file to load.")
 
 class TrimCacheRequest(BaseModel):
-    num_tokens: int = Field(..., ge=1, description="Number of tokens to trim from the start of the cache")
+    num_tokens: int = Field(..., ge=1, description="Number of most recent tokens to trim from the end of the cache")
 
 class CacheResponse(BaseModel):
     success: bool
@@ -139,14 +136,16 @@ class CacheResponse(BaseModel):
     cache_size: Optional[int] = Field(None, description="Number of tokens in the cache after operation, if applicable")
 
 class MemoryUsage(BaseModel):
-    rss_mb: float = Field(..., description="Resident Set Size in MB")
-    # gpu_active_mb: Optional[float] = Field(None, description="Estimated active GPU memory (if available)") # Future
+    rss_mb: float = Field(..., description="Resident Set Size in MB (refreshed less often when Metal stats are available)")
+    gpu_active_mb: Optional[float] = Field(None, description="Active MLX (Metal) memory in MB, if available")
+    peak_mb: Optional[float] = Field(None, description="Peak MLX (Metal) memory in MB since the last generation started, if available")
 
 class PerformanceMetrics(BaseModel):
-    timestamp: datetime = Field(default_factory=datetime.utcnow, description="Timestamp of the metrics snapshot")
+    timestamp: float = Field(default_factory=time.time, description="Unix epoch seconds of the metrics snapshot")
     tokens_per_second: Optional[float] = Field(None, description="Generation speed (tokens/sec) from last generation")
     memory_usage: Optional[MemoryUsage] = Field(None, description="Current memory usage of the backend process")
     cpu_usage_percent: Optional[float] = Field(None, description="Current system CPU usage percentage")
+    sample_interval_ms: Optional[int] = Field(None, description="Current interval between streamed samples (stream only)")
 
 class ConfigUpdateRequest(BaseModel):
     key: str = Field(..., description="Configuration key (dot notation, e.g., 'models.scan_directories')")
@@ -154,4 +153,4 @@ class ConfigUpdateRequest(BaseModel):
 
 class ConfigUpdateResponse(BaseModel):
     success: bool
-    message: Optional[str] = None
\ No newline at end of file
+    message: Optional[str] = None
@@ -3,12 +3,14 @@ Configuration module for mlxui backend.
 Loads settings from a JSON file, providing defaults if the file doesn't exist.
 """
 import os
-import json
 import logging
 import copy
 import asyncio
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable
+
+import orjson
 
 logger = logging.getLogger("mlxui.backend.config")
 
@@ -23,12 +25,12 @@ else:
 try:
     DEFAULT_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
 except OSError:
-    logger.warning(f"Could not create primary config directory at {DEFAULT_CONFIG_DIR}, falling back to ~/.mlxui")
+    logger.warning("Could not create primary config directory at %s, falling back to ~/.mlxui", DEFAULT_CONFIG_DIR)
     DEFAULT_CONFIG_DIR = Path.home() / ".mlxui"
     try:
         DEFAULT_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
     except OSError as e_fallback:
-        logger.error(f"Could not create fallback config directory at {DEFAULT_CONFIG_DIR}: {e_fallback}. Using in-memory defaults only.")
+        logger.error("Could not create fallback config directory at %s: %s. Using in-memory defaults only.", DEFAULT_CONFIG_DIR, e_fallback)
 
 DEFAULT_CONFIG_FILE = DEFAULT_CONFIG_DIR / "config.json"
 DEFAULT_MODELS_SCAN_DIR = DEFAULT_CONFIG_DIR / "models"
@@ -39,11 +41,21 @@ DEFAULT_CONFIG = {
         "host": "127.0.0.1",
         "port": 8000,
         "reload_backend_on_change": False,  # Renamed for clarity
+        # Origins allowed to call the API from a browser; "*" allows any.
+        "cors_origins": ["http://localhost:3000", "http://127.0.0.1:3000"],
     },
     "models": {
         "scan_directories": [str(DEFAULT_MODELS_SCAN_DIR)],
         "default_model_identifier": None,
+        # Draft model to start loading in the background whenever a model is loaded.
+        "default_draft_model_identifier": None,
         "cache_directory": str(DEFAULT_KV_CACHE_DIR),
+        # Prompt length of the warm-up pass used to size MLX's buffer cache after a load (0 disables).
+        "cache_warmup_tokens": 512,
+        # Quantize saved KV caches to this many bits (4 or 8); None saves them at full precision.
+        "kv_cache_save_bits": None,
+        # Compile each layer's MLP for single-token decode steps after a load (opt-in).
+        "compile_decode_mlp": False,
     },
     "generation": {  # These become the source of truth for API defaults if not provided in request
         "default_max_tokens": 4096,
@@ -59,6 +71,30 @@ DEFAULT_CONFIG = {
         "default_extra_eos_tokens": [],
         "default_ignore_chat_template": False,
         "default_seed": -1,  # -1 or None typically means random
+        # Requests queued behind a running generation are decoded together, up to this
+        # many per batch (1 runs them one after another).
+        "max_batch_size": 4,
+        # Quantize the KV cache of long-context models (over 4096 positions) to 8 bits past
+        # 2048 tokens, unless a request or default_kv_cache_options sets the bit width.
+        "auto_kv_cache_quantization": True,
+        # Generated tokens are passed to the response stream in groups of up to this many,
+        # or sooner once the oldest has waited stream_flush_interval_ms; 1 streams every token.
+        "stream_batch_size": 4,
+        "stream_flush_interval_ms": 20,
+        # Memory kept for snapshots of earlier conversations' prompt caches, so switching back
+        # to one (or reusing a long shared system prompt) skips its prefill; 0 disables.
+        "prefix_cache_max_mb": 1024,
+        # Bits those snapshots are quantized to while stored (None keeps full precision); they are
+        # dequantized again when resumed, so the cache a request works with stays unquantized.
+        "prefix_cache_kv_bits": 8,
+    },
+    "runtime": {
+        # Worker threads for blocking file and tokenizer work (MLX itself runs on one thread of
+        # its own); kept small so they don't compete with MLX for cores during decoding.
+        "thread_pool_size": 2,
+        # Run a full garbage collection after unloading a model. Weights are freed by reference
+        # counting anyway; this only reclaims objects caught in reference cycles.
+        "force_gc_on_unload": False,
     },
     "performance": {
         "enabled": True,
@@ -83,6 +119,13 @@ class Config:
         self._config_dir = DEFAULT_CONFIG_DIR
         self._config_file = DEFAULT_CONFIG_FILE
         self._config = copy.deepcopy(DEFAULT_CONFIG)
+        # Derived views of _config, rebuilt lazily after set() or load():
+        # the JSON encoding served by the config endpoint, and a dotted-key lookup table.
+        self._snapshot: Optional[bytes] = None
+        self._flat: Optional[Dict[str, Any]] = None
+        self._subscribers: Dict[str, List[Callable[[Any], None]]] = {}
+        self._file_lock = threading.Lock()  # One writer of config.json at a time
+        self._aset_lock = asyncio.Lock()  # Keeps async saves in the order their updates happened
         self._ensure_directories()
         self.load()
         self._initialized = True
@@ -100,77 +143,134 @@ class Config:
             kv_cache_dir.mkdir(parents=True, exist_ok=True)
 
         except OSError as e:
-            logger.warning(f"Could not create necessary config/model directories: {e}")
+            logger.warning("Could not create necessary config/model directories: %s", e)
 
     def load(self) -> None:
+        self._invalidate()
         if self._config_file.exists() and self._config_file.is_file():
             try:
-                with open(self._config_file, 'r', encoding='utf-8') as f:
-                    loaded_config = json.load(f)
+                loaded_config = orjson.loads(self._config_file.read_bytes())
                 self._deep_update(self._config, loaded_config)
-                logger.info(f"Loaded configuration from {self._config_file}")
-            except json.JSONDecodeError as e:
-                logger.error(f"Error decoding JSON from {self._config_file}: {e}. Using defaults and attempting to save.")
+                logger.info("Loaded configuration from %s", self._config_file)
+            except orjson.JSONDecodeError as e:
+                logger.error("Error decoding JSON from %s: %s. Using defaults and attempting to save.", self._config_file, e)
                 self._config = copy.deepcopy(DEFAULT_CONFIG)
                 self.save()
             except Exception as e:
-                logger.error(f"Could not load configuration from {self._config_file}: {e}. Using defaults.")
+                logger.error("Could not load configuration from %s: %s. Using defaults.", self._config_file, e)
                 self._config = copy.deepcopy(DEFAULT_CONFIG)
         else:
-            logger.info(f"Configuration file not found at {self._config_file}. Using default settings and creating file.")
+            logger.info("Configuration file not found at %s. Using default settings and creating file.", self._config_file)
             self.save()
 
     def save(self) -> bool:
+        return self._save_sync(self._config)
+
+    def _save_sync(self, config_data: Dict[str, Any]) -> bool:
+        """Blocking: write config_data to a temp file and atomically swap it into place."""
+        tmp_file = self._config_file.with_name(self._config_file.name + ".tmp")
         try:
-            self._config_dir.mkdir(parents=True, exist_ok=True)
-            sorted_config = self._sort_dict(self._config)
-            with open(self._config_file, 'w', encoding='utf-8') as f:
-                json.dump(sorted_config, f, indent=2, ensure_ascii=False)
-                f.write('\n')
-            logger.debug(f"Configuration saved to {self._config_file}")
+            with self._file_lock:
+                self._config_dir.mkdir(parents=True, exist_ok=True)
+                data = orjson.dumps(
+                    config_data,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+                )
+                fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    os.write(fd, data)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp_file, self._config_file)
+            logger.debug("Configuration saved to %s", self._config_file)
             return True
         except OSError as e:
-            logger.error(f"Could not write configuration file {self._config_file}: {e}")
+            logger.error("Could not write configuration file %s: %s", self._config_file, e)
         except Exception as e:
-            logger.error(f"Error saving configuration: {e}")
+            logger.error("Error saving configuration: %s", e)
         return False
 
     def get(self, key: Optional[str] = None, default: Any = None) -> Any:
         if key is None:
             return self._config
-        keys = key.split('.')
-        value = self._config
+        if self._flat is None:
+            self._flat = self._flatten(self._config)
         try:
-            for k in keys:
-                if isinstance(value, dict):
-                    value = value[k]
-                else:
-                    raise KeyError(f"Intermediate key '{k}' is not a dictionary in path '{key}'.")
-            return value
+            return self._flat[key]
         except KeyError:
-            logger.debug(f"Configuration key '{key}' not found, returning default: {default}")
+            logger.debug("Configuration key '%s' not found, returning default: %s", key, default)
             return default
-        except Exception as e:
-             logger.error(f"Unexpected error getting config key '{key}': {e}")
-             return default
 
     def set(self, key: str, value: Any) -> bool:
+        if not self._set_in_memory(key, value):
+            return False
+        return self.save()
+
+    async def aset(self, key: str, value: Any) -> bool:
+        """Like set(), but writes the file from a worker thread instead of blocking the event loop."""
+        if not self._set_in_memory(key, value):
+            return False
+        # Hand the thread a private copy so later in-memory updates can't race the dump.
+        config_data = copy.deepcopy(self._config)
+        async with self._aset_lock:
+            return await asyncio.get_running_loop().run_in_executor(None, self._save_sync, config_data)
+
+    def _set_in_memory(self, key: str, value: Any) -> bool:
         keys = key.split('.')
         config_ref = self._config
         try:
             for k_idx, k in enumerate(keys[:-1]):
                 config_ref = config_ref.setdefault(k, {})
                 if not isinstance(config_ref, dict):
-                    logger.error(f"Cannot set nested key '{key}': Intermediate key '{k}' (index {k_idx}) is not a dictionary.")
+                    logger.error("Cannot set nested key '%s': Intermediate key '%s' (index %s) is not a dictionary.", key, k, k_idx)
                     return False
             target_key = keys[-1]
             config_ref[target_key] = value
-            logger.info(f"Configuration updated: '{key}' set to '{value}'.")
-            return self.save()
+            self._invalidate()
+            logger.info("Configuration updated: '%s' set to '%s'.", key, value)
+            self._notify(key)
+            return True
         except Exception as e:
-            logger.error(f"Error setting configuration key '{key}': {e}")
+            logger.error("Error setting configuration key '%s': %s", key, e)
             return False
 
+    def subscribe(self, key: str, callback: Callable[[Any], None]) -> None:
+        """Call callback(new_value) whenever key, or a section containing it, is set."""
+        self._subscribers.setdefault(key, []).append(callback)
+
+    def _notify(self, changed_key: str) -> None:
+        for key, callbacks in self._subscribers.items():
+            if key == changed_key or key.startswith(changed_key + ".") or changed_key.startswith(key + "."):
+                value = self.get(key)
+                for callback in callbacks:
+                    try:
+                        callback(value)
+                    except Exception as e:
+                        logger.error("Configuration subscriber for '%s' failed: %s", key, e)
+
+    def _invalidate(self) -> None:
+        self._snapshot = None
+        self._flat = None
+
+    @classmethod
+    def _flatten(cls, d: Dict[str, Any], prefix: str = "", out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Map every dotted key path, including intermediate sections, to its value."""
+        if out is None:
+            out = {}
+        for k, v in d.items():
+            path = f"{prefix}{k}"
+            out[path] = v
+            if isinstance(v, dict):
+                cls._flatten(v, f"{path}.", out)
+        return out
+
+    def snapshot_bytes(self) -> bytes:
+        """The full configuration as JSON bytes, cached until the next set() or load()."""
+        if self._snapshot is None:
+            self._snapshot = orjson.dumps(self._config)
+        return self._snapshot
+
     def _deep_update(self, target: Dict[str, Any], source: Dict[str, Any]):
         for key, value in source.items():
             if isinstance(value, dict) and isinstance(target.get(key), dict):
@@ -178,8 +278,4 @@ class Config:
             else:
                 target[key] = value
 
-    def _sort_dict(self, d: Dict) -> Dict:
-        return {k: (self._sort_dict(v) if isinstance(v, dict) else v)
-                for k, v in sorted(d.items())}
-
 config = Config()
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Coalesced tokenization for prompts that arrive while other prompts are being encoded.
+
+The first prompt is encoded at once. Prompts that arrive while that call runs wait
+for it and are then encoded together in one encode_batch call on the Rust tokenizer,
+which splits the work across its own threads. Identical texts that are waiting at
+the same time are encoded once.
+"""
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("mlxui.backend.core.batch_encoder")
+
+# Most texts encoded in one batched call.
+ENCODE_BATCH_MAX = 32
+
+BatchEncodeFn = Callable[[List[str], bool], List[List[int]]]
+
+def batch_encoder_for(tokenizer: Any, encode: Callable[..., List[int]], fast: bool) -> BatchEncodeFn:
+    """Blocking-call factory: encode_batch on the Rust tokenizer when fast says encode
+    already goes straight to it (see mlx_adapter._fast_encoder), otherwise encode() per text."""
+    backend = getattr(getattr(tokenizer, "_tokenizer", None), "_tokenizer", None)
+    backend_batch = getattr(backend, "encode_batch", None)
+    if fast and backend_batch is not None:
+
+        def encode_batch(texts: List[str], add_special_tokens: bool) -> List[List[int]]:
+            return [e.ids for e in backend_batch(texts, add_special_tokens=add_special_tokens)]
+
+        return encode_batch
+
+    def encode_each(texts: List[str], add_special_tokens: bool) -> List[List[int]]:
+        return [encode(text, add_special_tokens=add_special_tokens) for text in texts]
+
+    return encode_each
+
+class BatchEncoder:
+    def __init__(self, executor: Executor):
+        self._executor = executor
+        self._encode_batch: Optional[BatchEncodeFn] = None
+        # (text, add_special_tokens) -> future, for texts waiting or being encoded.
+        self._waiting: Dict[Tuple[str, bool], asyncio.Future] = {}
+        self._running: Dict[Tuple[str, bool], asyncio.Future] = {}
+        self._drain_task: Optional[asyncio.Task] = None
+
+    def set_encoder(self, encode_batch: Optional[BatchEncodeFn]) -> None:
+        """Switch tokenizers; texts still waiting are encoded with the new one."""
+        self._encode_batch = encode_batch
+
+    async def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        """The token IDs for text, encoded alongside whatever else is waiting."""
+        key = (text, add_special_tokens)
+        future = self._running.get(key) or self._waiting.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._waiting[key] = future
+            if self._drain_task is None or self._drain_task.done():
+                self._drain_task = asyncio.ensure_future(self._drain())
+        # Shielded: one caller going away mustn't cancel the result for the others.
+        return await asyncio.shield(future)
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while self._waiting:
+            keys = list(self._waiting)[:ENCODE_BATCH_MAX]
+            batch = {key: self._waiting.pop(key) for key in keys}
+            self._running.update(batch)
+            try:
+                for special in (True, False):
+                    group = [key for key in keys if key[1] is special]
+                    if not group:
+                        continue
+                    try:
+                        if self._encode_batch is None:
+                            raise RuntimeError("No tokenizer loaded.")
+                        results = await loop.run_in_executor(
+                            self._executor, self._encode_batch, [text for text, _ in group], special
+                        )
+                    except Exception as e:
+                        for key in group:
+                            if not batch[key].done():
+                                batch[key].set_exception(e)
+                        continue
+                    for key, ids in zip(group, results):
+                        if not batch[key].done():
+                            batch[key].set_result(ids)
+                if len(keys) > 1:
+                    logger.debug("Encoded %d prompts in one batch.", len(keys))
+            finally:
+                for key, future in batch.items():
+                    self._running.pop(key, None)
+                    if not future.done():
+                        future.cancel()
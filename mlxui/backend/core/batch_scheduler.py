@@ -0,0 +1,258 @@
+"""
+Batched decoding for generation requests that queue up behind a running one.
+
+Requests that arrive while a generation holds the model are started together once
+it finishes: their prompts are left-padded to a common length, and each decode step
+is a single forward pass for the whole batch. Every request keeps its own sampler,
+logits processors and token stream. Batched requests don't read or update the
+adapter's prompt cache, so a request that turns out to be the only one waiting is
+handed back to the adapter's normal, cached path instead.
+"""
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, Callable, List, Optional, Sequence
+
+import mlx.core as mx
+import numpy as np
+
+try:
+    from mlx_lm.models.cache import make_prompt_cache
+except ImportError:  # The adapter reports the missing library; batching is never reached without it.
+    make_prompt_cache = None
+
+from ..api.schemas import TokenChunk
+from ..config import config as app_config
+from .prefix_cache import is_snapshottable
+
+if TYPE_CHECKING:
+    from .mlx_adapter import MLXAdapter
+
+logger = logging.getLogger("mlxui.backend.core.batch_scheduler")
+
+# Padded prompt tokens processed per batched prefill pass.
+BATCH_PREFILL_STEP = 512
+# Chunks buffered per request before the batch waits for that request's consumer.
+BATCH_QUEUE_SIZE = 32
+# Queued for a request that is the only one waiting: it runs on the adapter's normal path.
+_RUN_ALONE = object()
+
+@dataclass
+class _BatchRow:
+    prompt_tokens: "array[int]"
+    sampler: Callable
+    logits_processors: List[Callable]
+    max_tokens: int
+    # Running counts are sent with every this many tokens, like the normal path's chunk groups.
+    report_every: int
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=BATCH_QUEUE_SIZE))
+    # Set once the consumer has stopped reading; the row is then dropped from the batch.
+    cancelled: threading.Event = field(default_factory=threading.Event)
+
+def can_batch(model) -> bool:
+    """Whether model can be decoded in a padded batch.
+
+    The hand-built masks assume plain KV caches on every layer (no sliding windows or
+    recurrent state) and a model that takes a mask argument.
+    """
+    try:
+        takes_mask = "mask" in inspect.signature(model.__call__).parameters
+    except (TypeError, ValueError):
+        return False
+    return takes_mask and is_snapshottable(make_prompt_cache(model))
+
+def _prefill_mask(pads: mx.array, start: int, end: int) -> mx.array:
+    """Causal mask for prompt positions start..end that hides each row's left padding.
+
+    Padding positions attend to themselves only, so no row is ever fully masked.
+    """
+    queries = mx.arange(start, end)[:, None]
+    keys = mx.arange(end)[None]
+    return ((keys <= queries) & ((keys >= pads) | (keys == queries)))[:, None]
+
+def _new_detokenizer(tokenizer):
+    """A fresh streaming detokenizer of the kind tokenizer uses, for one batch row."""
+    # Older mlx-lm wrappers don't keep the class around; the live detokenizer's type
+    # takes the same tokenizer argument.
+    detokenizer_class = getattr(tokenizer, "_detokenizer_class", None) or type(tokenizer.detokenizer)
+    return detokenizer_class(tokenizer._tokenizer)
+
+class BatchScheduler:
+    def __init__(self, adapter: "MLXAdapter"):
+        self._adapter = adapter
+        self._pending: List[_BatchRow] = []
+        self._drain_task: Optional[asyncio.Task] = None
+
+    async def stream(
+        self,
+        prompt_tokens: Sequence[int],
+        sampler: Callable,
+        logits_processors: List[Callable],
+        max_tokens: int,
+        report_every: int = 1,
+    ) -> AsyncIterator[TokenChunk]:
+        """Queue a request for the next batch and yield its chunks as they are decoded.
+
+        Yields nothing when no other request was waiting alongside this one; the caller
+        then runs it itself.
+        """
+        row = _BatchRow(array("i", prompt_tokens), sampler, logits_processors, max_tokens, max(1, report_every))
+        self._pending.append(row)
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.ensure_future(self._drain())
+        try:
+            while True:
+                item = await row.queue.get()
+                if item is None or item is _RUN_ALONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            row.cancelled.set()
+            if row in self._pending:
+                self._pending.remove(row)
+
+    async def _drain(self):
+        adapter = self._adapter
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            async with adapter._generation_lock:
+                max_batch = max(1, app_config.get("generation.max_batch_size", 4))
+                rows = self._pending[:max_batch]
+                del self._pending[:max_batch]
+                rows = [row for row in rows if not row.cancelled.is_set()]
+                if not rows:
+                    continue
+                if len(rows) == 1:
+                    # Batching one request would only cost it the prompt cache.
+                    rows[0].queue.put_nowait(_RUN_ALONE)
+                    continue
+                adapter.generation_in_progress = True
+                try:
+                    await loop.run_in_executor(adapter._mlx_exec, self._run_batch, rows, loop)
+                finally:
+                    adapter.generation_in_progress = False
+
+    def _run_batch(self, rows: List[_BatchRow], loop: asyncio.AbstractEventLoop):
+        """Blocking: prefill and decode rows together, pushing each row's chunks to its queue."""
+
+        def _put(row: _BatchRow, item) -> bool:
+            # Blocks while the row's queue is full; gives up once its consumer has gone away.
+            put_future = asyncio.run_coroutine_threadsafe(row.queue.put(item), loop)
+            while True:
+                try:
+                    put_future.result(timeout=0.1)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if row.cancelled.is_set():
+                        put_future.cancel()
+                        return False
+
+        adapter = self._adapter
+        lock = adapter._mlx_lock
+        try:
+            model, tokenizer = adapter.model, adapter.tokenizer
+            if model is None or tokenizer is None:
+                raise RuntimeError("No model or tokenizer loaded.")
+            logger.info("Decoding %d queued requests as one batch.", len(rows))
+
+            lengths = [len(row.prompt_tokens) for row in rows]
+            width = max(lengths)
+            # Left-padded prompts, filled from each row's int32 buffer and handed to MLX as one copy.
+            padded = np.zeros((len(rows), width), dtype=np.int32)
+            for i, (row, n) in enumerate(zip(rows, lengths)):
+                padded[i, width - n:] = np.frombuffer(row.prompt_tokens, dtype=np.int32)
+            with lock:
+                pads = mx.array([width - n for n in lengths])[:, None, None]
+                inputs = mx.array(padded)
+                cache = make_prompt_cache(model)
+                histories = [mx.array(row.prompt_tokens) if row.logits_processors else None for row in rows]
+            del padded
+            for start in range(0, width, BATCH_PREFILL_STEP):
+                end = min(width, start + BATCH_PREFILL_STEP)
+                with lock:
+                    logits = model(inputs[:, start:end], mask=_prefill_mask(pads, start, end), cache=cache)
+                    if end < width:
+                        mx.eval([c.state for c in cache])
+                    else:
+                        logits = logits[:, -1, :]
+
+            detokenizers = [_new_detokenizer(tokenizer) for _ in rows]
+            eos_token_ids = tokenizer.eos_token_ids
+            counts = [0] * len(rows)
+            active = [True] * len(rows)
+            total_len = width
+            tic = time.perf_counter()
+
+            while True:
+                with lock:
+                    sampled = []
+                    for i, row in enumerate(rows):
+                        row_logits = logits[i : i + 1]
+                        for processor in row.logits_processors:
+                            row_logits = processor(histories[i], row_logits)
+                        logprobs = row_logits - mx.logsumexp(row_logits, axis=-1, keepdims=True)
+                        sampled.append(row.sampler(logprobs))
+                    next_tokens = mx.concatenate(sampled)
+                    tokens = next_tokens.tolist()
+
+                elapsed = max(time.perf_counter() - tic, 1e-9)
+                for i, row in enumerate(rows):
+                    if not active[i]:
+                        continue
+                    if row.cancelled.is_set():
+                        active[i] = False
+                        continue
+                    token = tokens[i]
+                    counts[i] += 1
+                    detokenizer = detokenizers[i]
+                    finish_reason = None
+                    if token in eos_token_ids:
+                        finish_reason = "stop"
+                    else:
+                        detokenizer.add_token(token)
+                        if counts[i] >= row.max_tokens:
+                            finish_reason = "length"
+                    if finish_reason is not None:
+                        detokenizer.finalize()
+                        active[i] = False
+                    # Same fields as the normal path: prompt_tokens on the first and final chunk,
+                    # running counts on those and once per report_every tokens.
+                    edge = counts[i] == 1 or finish_reason is not None
+                    report = edge or counts[i] % row.report_every == 0
+                    chunk = TokenChunk(
+                        text=detokenizer.last_segment,
+                        is_finished=finish_reason is not None,
+                        finish_reason=finish_reason,
+                        token_count=1, token=token,
+                        prompt_tokens=lengths[i] if edge else None,
+                        generation_tokens=counts[i] if report else None,
+                        generation_tps=counts[i] / elapsed if report else None,
+                    )
+                    if not _put(row, chunk):
+                        active[i] = False
+                adapter.last_generation_tps = sum(counts) / elapsed
+                if not any(active):
+                    break
+
+                total_len += 1
+                with lock:
+                    for i, history in enumerate(histories):
+                        if history is not None and active[i]:
+                            histories[i] = mx.concatenate([history, next_tokens[i : i + 1]])
+                    mask = (mx.arange(total_len)[None, None] >= pads)[:, None]
+                    logits = model(next_tokens[:, None], mask=mask, cache=cache)[:, -1, :]
+            logger.info("Batch finished: %d tokens across %d requests.", sum(counts), len(rows))
+        except Exception as e:
+            logger.exception("Batched generation failed:")
+            for row in rows:
+                _put(row, e)
+        finally:
+            for row in rows:
+                _put(row, None)
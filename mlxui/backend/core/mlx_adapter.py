@@ -1,21 +1,33 @@
 import asyncio
+import base64
+import concurrent.futures
+import dataclasses
 import gc
-import json
+import hashlib
 import logging
+import os
+import threading
 import time
 import sys
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, suppress
+from functools import lru_cache, partial
+from array import array
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal, Optional, Sequence, Tuple, Union
 
 import mlx.core as mx
 import mlx.nn as nn
+from mlx.utils import tree_flatten
+import numpy as np
+import orjson
 from pydantic import BaseModel  # Added for messages type hinting
 
 try:
     from mlx_lm.generate import GenerationResponse as MLXInternalGenerationResponse
     from mlx_lm.generate import stream_generate
-    from mlx_lm.models.cache import (can_trim_prompt_cache, load_prompt_cache,
+    from mlx_lm.models.cache import (KVCache, can_trim_prompt_cache, load_prompt_cache,
                                      make_prompt_cache, save_prompt_cache,
                                      trim_prompt_cache)
     from mlx_lm.sample_utils import make_logits_processors, make_sampler
@@ -46,6 +58,9 @@ except ImportError as e:
 from ..config import config as app_config
 from ..config import DEFAULT_CONFIG_DIR, DEFAULT_MODELS_SCAN_DIR, DEFAULT_KV_CACHE_DIR
 from ..api.schemas import GenerationRequest, TokenChunk, ModelInfo
+from .batch_encoder import BatchEncoder, batch_encoder_for
+from .batch_scheduler import BatchScheduler, can_batch
+from .prefix_cache import PREFIX_CACHE_MIN_MATCH, PrefixCacheStore, common_token_prefix_len
 
 logger = logging.getLogger("mlxui.backend.core.adapter")
 
@@ -61,29 +76,353 @@ async def get_mlx_adapter() -> 'MLXAdapter':
                 _adapter_instance = MLXAdapter()
     return _adapter_instance
 
+async def shutdown_mlx_adapter() -> None:
+    """Release the adapter's worker threads on server shutdown, if an adapter was ever created."""
+    if _adapter_instance is not None:
+        await _adapter_instance.aclose()
+
+def io_thread_count() -> int:
+    """Size of the worker pools for blocking non-MLX work (runtime.thread_pool_size)."""
+    try:
+        return max(1, int(app_config.get("runtime.thread_pool_size", 2)))
+    except (TypeError, ValueError):
+        return 2
+
+def _fast_encoder(tokenizer: Any) -> Tuple[Callable[..., List[int]], bool]:
+    """Blocking: (encode, fast), where encode is tokenizer.encode, or the Rust tokenizer
+    underneath it when that gives the same IDs; fast says which one was picked.
+
+    Calling the `tokenizers` backend directly skips the Python wrapper's per-call
+    setup. A one-off comparison against encode() keeps tokenizers whose wrapper
+    does its own preprocessing on the slow path.
+    """
+    backend = getattr(getattr(tokenizer, "_tokenizer", None), "_tokenizer", None)
+    backend_encode = getattr(backend, "encode", None)
+    if backend_encode is None:
+        return tokenizer.encode, False
+
+    def encode(text: str, add_special_tokens: bool = True) -> List[int]:
+        return backend_encode(text, add_special_tokens=add_special_tokens).ids
+
+    sample = "Hello, world! 12 345\n  indented\tcafé 你好"
+    try:
+        if all(
+            encode(sample, add_special_tokens=special) == list(tokenizer.encode(sample, add_special_tokens=special))
+            for special in (True, False)
+        ):
+            return encode, True
+    except Exception as e:
+        logger.debug("Fast tokenizer path unavailable (ignored): %s", e)
+    return tokenizer.encode, False
+
+def _warm_tokenizer(tokenizer: Any) -> None:
+    """Blocking: run the tokenizer and chat template once, so the first request doesn't pay
+    for their one-time setup (e.g. compiling the Jinja template)."""
+    try:
+        tokenizer.encode("Hello")
+        if getattr(tokenizer, "chat_template", None):
+            tokenizer.apply_chat_template(
+                [{"role": "user", "content": "Hello"}], tokenize=False, add_generation_prompt=True
+            )
+    except Exception as e:
+        logger.debug("Tokenizer warm-up failed (ignored): %s", e)
+
+def _describe_identifier(identifier: str) -> Tuple[Optional[str], Literal["local", "hub"], str]:
+    """Blocking: classify a model identifier as (resolved path, source, display name)."""
+    path_obj = Path(identifier)
+    if path_obj.is_dir():
+        return str(path_obj.resolve()), "local", path_obj.name
+    return None, "hub", identifier
+
+# Groups of generated chunks buffered between the MLX thread and the consumer before decoding pauses.
+GENERATION_QUEUE_SIZE = 32
+# Stands in for the token IDs of a cache loaded from a file, which aren't stored with it.
+# No real token has this ID, so prefix matching never treats the placeholders as a match.
+UNKNOWN_TOKEN = -1
+# Sampler and logits-processor settings whose built callables are kept for reuse.
+SAMPLING_CACHE_SIZE = 16
+# Generated token IDs are added to prompt_cache_tokens in batches of this many.
+TOKEN_FLUSH_SIZE = 32
+# Tokens per forward pass when a newly attached draft model catches up on the cached prompt.
+DRAFT_PREFILL_STEP = 2048
+# Bytes of draft model weights read in per MLX lock hold, so a running generation keeps going meanwhile.
+DRAFT_LOAD_CHUNK_BYTES = 64 * 1024 * 1024
+# Draft models kept loaded, so switching back and forth between them doesn't reload them.
+DRAFT_POOL_SIZE = 3
+# Prompt encodings kept per loaded tokenizer; longer prompts are keyed by a digest, not the text.
+ENCODE_CACHE_SIZE = 256
+ENCODE_CACHE_HASH_MIN_LEN = 4096
+# Conversations whose rendered chat template and its token IDs are kept for reuse.
+TEMPLATE_CACHE_SIZE = 64
+
+def _config_from_model(model: Any) -> Dict[str, Any]:
+    """The model's config rebuilt from its in-memory args, or {} if it has none.
+
+    mlx-lm drops the top-level "quantization" entry when it builds the args, so it
+    is recovered from the first quantized layer's group size and bit width.
+    """
+    args = getattr(model, "args", None)
+    if args is None:
+        return {}
+    if hasattr(args, "to_dict"):
+        config_dict = dict(args.to_dict())
+    elif dataclasses.is_dataclass(args):
+        config_dict = dataclasses.asdict(args)
+    else:
+        config_dict = dict(vars(args))
+    if config_dict and "quantization" not in config_dict:
+        for _, module in model.named_modules():
+            if isinstance(module, (nn.QuantizedLinear, nn.QuantizedEmbedding)):
+                config_dict["quantization"] = {"group_size": module.group_size, "bits": module.bits}
+                break
+    return config_dict
+
+# Models with a longer context than this get 8-bit KV caches past LONG_CONTEXT_KV_START tokens.
+LONG_CONTEXT_MIN_POSITIONS = 4096
+LONG_CONTEXT_KV_START = 2048
+
+def _long_context_kv_options(config_dict: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Default KV quantization for a long-context model, or None to keep full precision.
+
+    Past a few thousand tokens the KV cache is most of what each decode step reads,
+    so storing it in 8 bits roughly halves that traffic.
+    """
+    if (config_dict.get("max_position_embeddings") or 0) <= LONG_CONTEXT_MIN_POSITIONS:
+        return None
+    group_size = 64
+    head_dim = config_dict.get("head_dim")
+    if not head_dim and config_dict.get("hidden_size") and config_dict.get("num_attention_heads"):
+        head_dim = config_dict["hidden_size"] // config_dict["num_attention_heads"]
+    if not head_dim or head_dim % group_size:
+        return None  # Quantized caches need the head dimension to split into whole groups
+    return {"kv_bits": 8, "kv_group_size": group_size, "quantized_kv_start": LONG_CONTEXT_KV_START}
+
+_DECODE_MLP_CLASSES: Dict[type, type] = {}
+
+def _decode_mlp_class(cls: type) -> type:
+    """A subclass of cls whose single-token calls go through the instance's compiled forward."""
+    sub = _DECODE_MLP_CLASSES.get(cls)
+    if sub is None:
+        def __call__(self, x, *args, **kwargs):
+            if x.ndim == 3 and x.shape[1] == 1 and not args and not kwargs:
+                return self._compiled_decode(x)
+            return cls.__call__(self, x, *args, **kwargs)
+        sub = type(cls.__name__, (cls,), {"__call__": __call__})
+        _DECODE_MLP_CLASSES[cls] = sub
+    return sub
+
+def _compile_decode_mlps(model: nn.Module) -> int:
+    """Blocking: compile the gated MLP of each layer for single-token inputs; returns how many.
+
+    Decoding calls every MLP with a (batch, 1, hidden) input, so one compiled graph per
+    layer fuses its activation and gating. Prefill lengths vary and stay eager; the
+    attention blocks are left alone because the KV cache is updated in Python.
+    """
+    compiled = 0
+    for _, module in model.named_modules():
+        if not all(hasattr(module, name) for name in ("gate_proj", "up_proj", "down_proj")):
+            continue
+        cls = type(module)
+        module._compiled_decode = mx.compile(partial(cls.__call__, module))
+        module.__class__ = _decode_mlp_class(cls)
+        compiled += 1
+    return compiled
+
+def _pack_token_ids(tokens: "array[int]") -> str:
+    """Token IDs as base64 of little-endian int32, for a cache file's str -> str metadata."""
+    if sys.byteorder == "big":
+        tokens = array("i", tokens)
+        tokens.byteswap()
+    return base64.b64encode(tokens.tobytes()).decode("ascii")
+
+def _unpack_token_ids(metadata: Dict[str, str]) -> "array[int]":
+    """The token IDs saved with a cache file; UNKNOWN_TOKEN placeholders for files without them."""
+    token_count = int(metadata.get("token_count", 0))
+    tokens = array("i")
+    try:
+        tokens.frombytes(base64.b64decode(metadata.get("token_ids", "")))
+    except ValueError:
+        del tokens[:]
+    if len(tokens) != token_count:
+        return array("i", [UNKNOWN_TOKEN]) * token_count
+    if sys.byteorder == "big":
+        tokens.byteswap()
+    return tokens
+
+def _release_compiled_mlps(model: nn.Module) -> None:
+    """Undo _compile_decode_mlps, whose compiled forwards refer back to their modules.
+
+    Dropping them breaks those reference cycles, so the model is freed without a gc pass.
+    """
+    for _, module in model.named_modules():
+        if "_compiled_decode" in vars(module):
+            del module._compiled_decode
+            module.__class__ = type(module).__mro__[1]
+
+def _scan_dir_signature(scan_dir: Path) -> Tuple[int, Tuple[Tuple[str, int], ...]]:
+    """Blocking: scan_dir's mtime plus the name and mtime of each subdirectory."""
+    with os.scandir(scan_dir) as it:
+        subdirs = tuple(sorted(
+            (entry.name, entry.stat().st_mtime_ns) for entry in it if entry.is_dir()
+        ))
+    return scan_dir.stat().st_mtime_ns, subdirs
+
+@lru_cache(maxsize=128)
+def _read_config_snippet(model_path: Path, mtime_ns: int) -> Dict[str, Any]:
+    # mtime_ns is only part of the cache key, so an edited config.json is re-read.
+    # Parsed from the raw bytes with orjson rather than through load_config.
+    config_content = orjson.loads((model_path / "config.json").read_bytes())
+    return {
+        "model_type": config_content.get("model_type"),
+        "quantization": config_content.get("quantization"),
+        "hidden_size": config_content.get("hidden_size"),
+        "num_hidden_layers": config_content.get("num_hidden_layers"),
+    }
+
+def _model_config_snippet(model_path: Path) -> Dict[str, Any]:
+    """Blocking: the config fields shown in the model list, or {} if config.json can't be read."""
+    try:
+        return _read_config_snippet(model_path, (model_path / "config.json").stat().st_mtime_ns)
+    except Exception:
+        return {}
+
+def _is_complete_model_dir(item_path: Path) -> bool:
+    """Blocking: whether item_path holds config.json, a tokenizer and safetensors weights.
+
+    One directory read, stopping as soon as everything has been seen; model directories
+    can hold hundreds of weight shards.
+    """
+    has_config = has_tokenizer = has_weights = False
+    with os.scandir(item_path) as it:
+        for entry in it:
+            name = entry.name
+            if name == "config.json":
+                has_config = True
+            elif name == "tokenizer.json" or name == "tokenizer.model":
+                has_tokenizer = True
+            elif not has_weights and name.endswith(".safetensors"):
+                has_weights = True
+            else:
+                continue
+            if has_config and has_tokenizer and has_weights:
+                return True
+    return False
+
+def _local_model_entry(item_path: Path) -> Optional[Dict[str, Any]]:
+    """Blocking: the model list entry for item_path, or None if it doesn't hold a complete model."""
+    if not _is_complete_model_dir(item_path):
+        return None
+    model_full_path = str(item_path.resolve())
+    return {
+        "id": model_full_path,
+        "name": item_path.name,
+        "path": model_full_path,
+        "source": "local",
+        "config": _model_config_snippet(item_path),
+    }
+
 class MLXAdapter:
     def __init__(self):
+        # mlx-lm is imported once at module load, so its availability can't change while
+        # the server runs; hot paths read this attribute instead of calling is_available().
+        self.available = MLX_LM_AVAILABLE
+        # MLX work runs on one thread, so model, cache and generation calls never overlap;
+        # filesystem and tokenizer work gets a small pool of its own instead of the default executor.
+        self._mlx_exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlx")
+        self._io_exec = ThreadPoolExecutor(
+            max_workers=io_thread_count(), thread_name_prefix="mlxui-io"
+        )
+        # KV cache files are flushed to disk and renamed into place here, so a slow
+        # disk holds up neither the MLX thread nor the IO pool used by generation.
+        self._kv_save_exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlxui-kvsave")
+        # Prompts that miss the encode caches while another one is being encoded are encoded together.
+        self._batch_encoder = BatchEncoder(self._io_exec)
+        # Held around every call that evaluates MLX arrays or touches the model/prompt cache.
+        # MLX is not thread-safe; this also covers MLX calls made outside the MLX executor.
+        self._mlx_lock = threading.RLock()
         if not MLX_LM_AVAILABLE:
             logger.error("mlx-lm library is NOT available. MLXAdapter will be non-functional.")
         self._set_initial_state()
         self.last_generation_tps: Optional[float] = None
+        self.unload_in_progress = False
+        self.unloading_model_info: Optional[ModelInfo] = None
+        self.generation_in_progress = False
+        # Held by the generation using the shared prompt cache; requests arriving meanwhile
+        # are decoded together by the batch scheduler once it is released.
+        self._generation_lock = asyncio.Lock()
+        # KV cache directory, resolved once and again when the setting changes; it is
+        # created by the first save after that.
+        self._on_cache_directory_change(app_config.get("models.cache_directory", str(DEFAULT_KV_CACHE_DIR)))
+        app_config.subscribe("models.cache_directory", self._on_cache_directory_change)
+        # Samplers and logits processors by their settings, most recently used last (see _cached_sampling).
+        self._sampler_cache: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._logits_processors_cache: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._batch_scheduler = BatchScheduler(self)
+        # MLX buffer cache limit set from the last model's warm-up pass; None means MLX's default.
+        self.cache_limit_bytes: Optional[int] = None
+        # Per scan directory: (_scan_dir_signature(), model entries found there).
+        self._scan_cache: Dict[Path, Tuple[Any, List[Dict[str, Any]]]] = {}
         logger.info("MLXAdapter initialized." if MLX_LM_AVAILABLE else "MLXAdapter initialized (NON-FUNCTIONAL).")
 
     def _set_initial_state(self):
         self.model: Optional[nn.Module] = None
         self.tokenizer: Optional[TokenizerWrapper] = None
         self.prompt_cache: Optional[List[Any]] = None
-        self.prompt_cache_tokens: List[int] = []
+        # Token IDs the prompt cache holds, as a flat C int array (4 bytes per token, no
+        # per-token objects; numpy and MLX can read it in place through the buffer protocol).
+        self.prompt_cache_tokens: "array[int]" = array("i")
+        # Earlier prompt caches for the loaded model, resumed from when a prompt returns to them.
+        self._prefix_store = PrefixCacheStore()
         self.draft_model: Optional[nn.Module] = None
         self.draft_tokenizer: Optional[TokenizerWrapper] = None
+        # Recently used draft models (loaded or loading) by identifier, most recently used last (see _get_draft_model).
+        self._draft_models: "OrderedDict[str, asyncio.Task[Tuple[nn.Module, TokenizerWrapper]]]" = OrderedDict()
+        # Recent prompt encodings for the loaded tokenizer, most recently used last (see _encode).
+        self._encode_cache: "OrderedDict[Union[str, bytes], array[int]]" = OrderedDict()
+        # Rendered chat templates and their token IDs for the loaded tokenizer, most recently used last (see _encode_chat).
+        self._template_cache: "OrderedDict[bytes, Tuple[str, array[int]]]" = OrderedDict()
+        self._batch_encoder.set_encoder(None)
         self.current_config: Optional[dict] = None
+        # KV cache quantization applied when neither the request nor the config sets one
+        # (see _long_context_kv_options); None leaves the cache at full precision.
+        self._default_kv_quant: Optional[Dict[str, int]] = None
+        # Whether the loaded model can be decoded by the batch scheduler (see can_batch).
+        self._batchable = False
         self.current_identifier: Optional[str] = None
         self.current_adapter_path: Optional[str] = None
         self.current_draft_identifier: Optional[str] = None
+        self.loaded_model_info: Optional[ModelInfo] = None
         self.last_generation_tps = None
 
+    async def aclose(self):
+        """Stop the worker threads; queued work is cancelled, running work finishes in the background."""
+        self._mlx_exec.shutdown(wait=False, cancel_futures=True)
+        self._io_exec.shutdown(wait=False, cancel_futures=True)
+        # Queued saves still run, so no half-committed temp file is left behind.
+        self._kv_save_exec.shutdown(wait=False)
+
+    def _locked_call(self, fn, *args, **kwargs):
+        with self._mlx_lock:
+            return fn(*args, **kwargs)
+
+    async def _run_mlx(self, fn, *args):
+        """Run fn on the MLX thread while holding the MLX lock."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._mlx_exec, partial(self._locked_call, fn, *args)
+        )
+
+    def _locked_steps(self, iterator):
+        """Yield from an MLX generator, holding the MLX lock only while it computes each step."""
+        while True:
+            with self._mlx_lock:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
     def is_available(self) -> bool:
-        return MLX_LM_AVAILABLE
+        return self.available
 
     def _raise_if_unavailable(self):
         if not self.is_available():
@@ -95,15 +434,32 @@ class MLXAdapter:
     def _clear_state(self):
         logger.info("Clearing MLXAdapter state...")
         old_identifier = self.current_identifier
+        old_model = self.model
         self._set_initial_state()
+        if old_model is not None:
+            _release_compiled_mlps(old_model)
+        # Model weights are freed by reference counting as soon as the last reference goes;
+        # a full collection only helps with cycles and stalls the event loop on large heaps.
+        del old_model
         if self.is_available():
-            gc.collect()
+            if app_config.get("runtime.force_gc_on_unload", False):
+                gc.collect()
+            if self.cache_limit_bytes is not None:
+                return  # The measured cache limit already bounds what freed buffers can hold.
             try:
                 mx.clear_cache()
                 logger.debug("Cleared MLX cache.")
             except Exception as e:
                 logger.warning(f"Could not clear MLX cache during state clear for '{old_identifier}': {e}")
 
+    @staticmethod
+    def _measure_cache_overhead_sync(model: nn.Module, warmup_len: int) -> int:
+        """Blocking: bytes MLX's buffer cache grows by over one forward pass of warmup_len tokens."""
+        mx.clear_cache()
+        baseline = mx.get_cache_memory()
+        mx.eval(model(mx.array([[0] * warmup_len])))
+        return mx.get_cache_memory() - baseline
+
     async def load_model(
         self,
         identifier: str,
@@ -126,39 +482,90 @@ class MLXAdapter:
         try:
             logger.info(f"Starting load of model '{identifier}'...")
             loop = asyncio.get_running_loop()
-            
-            load_fn_with_kwargs = partial(load, adapter_path=adapter_path, lazy=False)
-            model_instance, tokenizer_instance = await loop.run_in_executor(
-                None, load_fn_with_kwargs, identifier
+
+            warmup_len = app_config.get("models.cache_warmup_tokens", 512)
+            compile_decode = app_config.get("models.compile_decode_mlp", False)
+
+            def _materialize(model: nn.Module):
+                mx.eval(model.parameters())
+                if compile_decode:
+                    _compile_decode_mlps(model)
+
+            # Built lazily, so the weights are only read in by _materialize; resolving the
+            # identifier and warming the tokenizer run on the I/O pool meanwhile.
+            model_instance, tokenizer_instance = await self._run_mlx(
+                partial(load, identifier, adapter_path=adapter_path, lazy=True)
+            )
+            _, location, _, (tokenizer_encode, fast_encode) = await asyncio.gather(
+                self._run_mlx(_materialize, model_instance),
+                loop.run_in_executor(self._io_exec, _describe_identifier, identifier),
+                loop.run_in_executor(self._io_exec, _warm_tokenizer, tokenizer_instance),
+                loop.run_in_executor(self._io_exec, _fast_encoder, tokenizer_instance),
             )
             logger.info(f"Model and tokenizer for '{identifier}' loaded in memory.")
 
+            # Size the buffer cache to what one prompt actually needs, so buffers freed
+            # by differently sized requests don't pile up between generations.
+            if warmup_len:
+                try:
+                    overhead = await self._run_mlx(self._measure_cache_overhead_sync, model_instance, warmup_len)
+                    if overhead > 0:
+                        mx.set_cache_limit(overhead)
+                        self.cache_limit_bytes = overhead
+                        logger.info("MLX buffer cache limit set to %.1f MB from a %d-token warm-up.", overhead / (1024 * 1024), warmup_len)
+                except Exception as e:
+                    logger.warning("Cache warm-up for '%s' failed; leaving MLX's cache limit unchanged: %s", identifier, e)
+
+            # The loaded model already carries its config; only go back to disk for
+            # architectures whose args can't be turned into a dict.
             try:
-                model_path_obj = await loop.run_in_executor(None, get_model_path, identifier)
-                config_dict = await loop.run_in_executor(None, load_config, model_path_obj)
+                config_dict = _config_from_model(model_instance)
             except Exception:
-                config_dict = (
-                    model_instance.args.to_dict()
-                    if hasattr(model_instance, "args")
-                    and hasattr(model_instance.args, "to_dict")
-                    else {}
-                )
+                config_dict = {}
+            if not config_dict:
+                try:
+                    model_path_obj = await loop.run_in_executor(self._io_exec, get_model_path, identifier)
+                    config_dict = await loop.run_in_executor(self._io_exec, load_config, model_path_obj)
+                except Exception:
+                    config_dict = {}
 
 
             self.model = model_instance
             self.tokenizer = tokenizer_instance # type: ignore
+            self._batch_encoder.set_encoder(batch_encoder_for(tokenizer_instance, tokenizer_encode, fast_encode))
             self.current_config = config_dict
+            self._batchable = can_batch(model_instance)
+            self._default_kv_quant = (
+                _long_context_kv_options(config_dict)
+                if app_config.get("generation.auto_kv_cache_quantization", True)
+                else None
+            )
+            if self._default_kv_quant:
+                logger.info(
+                    "Long-context model: KV cache defaults to %d-bit past %d tokens.",
+                    self._default_kv_quant["kv_bits"], self._default_kv_quant["quantized_kv_start"],
+                )
             self.current_identifier = identifier
             self.current_adapter_path = adapter_path
             self.prompt_cache = None
-            self.prompt_cache_tokens = []
+            self.prompt_cache_tokens = array("i")
             if self.draft_model:
                 self.draft_model = None
                 self.current_draft_identifier = None
                 logger.info("Unloaded previous draft model due to main model change.")
 
+            self.loaded_model_info = self._make_current_model_info(*location)
+
+            draft_hint = app_config.get("models.default_draft_model_identifier")
+            if draft_hint:
+                self._get_draft_model(draft_hint)  # Starts loading now; awaited by the first speculative request
+
             logger.info(f"Successfully assigned model '{identifier}' to adapter state.")
-            return {"success": True, "message": f"Model '{identifier}' loaded successfully."}
+            return {
+                "success": True,
+                "message": f"Model '{identifier}' loaded successfully.",
+                "model_info": self.loaded_model_info,
+            }
 
         except FileNotFoundError as e:
              logger.error(f"Model file not found for '{identifier}': {e}")
@@ -169,46 +576,201 @@ class MLXAdapter:
             self._clear_state()
             raise RuntimeError(f"Failed to load model '{identifier}': {str(e)}")
 
+    def begin_unload(self):
+        """Flag an unload as in progress, keeping a snapshot of the model for status queries."""
+        self.unload_in_progress = True
+        if self.loaded_model_info is not None:
+            self.unloading_model_info = self.loaded_model_info.model_copy(
+                update={"is_unloading": True}
+            )
+
     async def unload_model(self) -> bool:
         self._raise_if_unavailable()
         if not self.is_model_loaded():
             logger.info("No model currently loaded, nothing to unload.")
+            self.unload_in_progress = False
+            self.unloading_model_info = None
             return True
         identifier = self.current_identifier
         logger.info(f"Unloading model '{identifier}'...")
+        self.begin_unload()
         try:
             loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, self._clear_state)
+            await self._run_mlx(self._clear_state)
             logger.info(f"Model '{identifier}' unloaded successfully.")
             return True
         except Exception as e:
             logger.exception(f"Error during model unload for '{identifier}':")
             return False
+        finally:
+            self.unload_in_progress = False
+            self.unloading_model_info = None
+
+    async def _encode(self, text: str) -> "array[int]":
+        """tokenizer.encode(text) through a small LRU; chat turns re-encode the same history every time.
+
+        Token IDs are kept as array('i'), like prompt_cache_tokens, so comparing and copying
+        them works on the raw buffer. The returned array is shared with the cache and must
+        not be mutated.
+        """
+        key: Union[str, bytes] = (
+            hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+            if len(text) > ENCODE_CACHE_HASH_MIN_LEN else text
+        )
+        # Bound before the await: a model loaded meanwhile gets a new cache, which
+        # mustn't receive IDs from the old tokenizer.
+        cache = self._encode_cache
+        tokens = cache.get(key)
+        if tokens is not None:
+            cache.move_to_end(key)
+            return tokens
+        tokens = array("i", await self._batch_encoder.encode(text))
+        cache[key] = tokens
+        if len(cache) > ENCODE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return tokens
+
+    async def _encode_chat(self, messages: List[Dict[str, Any]]) -> Optional[Tuple[str, "array[int]"]]:
+        """The chat template rendered for messages and its token IDs, through a small LRU keyed on their content.
+
+        Regenerating or resubmitting a conversation then skips both the Jinja rendering
+        and the encoding. Returns None when the template renders nothing; the returned
+        array is shared with the cache and must not be mutated.
+        """
+        try:
+            key: Optional[bytes] = hashlib.blake2b(
+                orjson.dumps(messages, option=orjson.OPT_SORT_KEYS), digest_size=16
+            ).digest()
+        except TypeError:  # Content orjson can't serialize; render it uncached
+            key = None
+        cache = self._template_cache  # Bound before the awaits, as in _encode
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                cache.move_to_end(key)
+                return cached
+        rendered = await asyncio.get_running_loop().run_in_executor(
+            self._io_exec,
+            partial(
+                self.tokenizer.apply_chat_template,  # type: ignore
+                messages,
+                tokenize=False,
+                add_generation_prompt=True,
+            ),
+        )
+        if rendered is None:
+            return None
+        # Encoded the way apply_chat_template(tokenize=True) does it: the template writes
+        # any BOS token itself, so none is added on top. This keeps the rendered string
+        # without rendering the template a second time.
+        result = (rendered, array("i", await self._batch_encoder.encode(rendered, add_special_tokens=False)))
+        if key is not None:
+            cache[key] = result
+            if len(cache) > TEMPLATE_CACHE_SIZE:
+                cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _cached_sampling(cache: "OrderedDict[Tuple, Any]", factory, **params) -> Any:
+        """factory(**params), reusing the result of an earlier call with the same params.
+
+        Samplers and logits processors don't keep state between calls, so requests
+        with the same settings can share them.
+        """
+        key = tuple(
+            (name, frozenset(value.items()) if isinstance(value, dict) else value)
+            for name, value in sorted(params.items())
+        )
+        result = cache.get(key)
+        if result is not None:
+            cache.move_to_end(key)
+            return result
+        result = cache[key] = factory(**params)
+        if len(cache) > SAMPLING_CACHE_SIZE:
+            cache.popitem(last=False)
+        return result
+
+    def _get_draft_model(self, identifier: str) -> "asyncio.Task[Tuple[nn.Module, TokenizerWrapper]]":
+        """The (model, tokenizer) load task for a draft model, started on first use and then reused.
+
+        The DRAFT_POOL_SIZE most recently used draft models stay loaded; older ones are
+        dropped unless still loading or in use.
+        """
+        task = self._draft_models.get(identifier)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            logger.info(f"Loading draft model for speculative decoding: {identifier}")
+            task = asyncio.ensure_future(self._load_draft_model(identifier))
+            # Retrieve a failure here too, so a prewarm nobody awaits doesn't log "never retrieved".
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._draft_models[identifier] = task
+        self._draft_models.move_to_end(identifier)
+        for old_identifier in list(self._draft_models)[:-DRAFT_POOL_SIZE]:
+            if old_identifier != self.current_draft_identifier and self._draft_models[old_identifier].done():
+                del self._draft_models[old_identifier]
+                logger.info("Dropped draft model '%s' from the loaded pool.", old_identifier)
+        return task
+
+    async def _load_draft_model(self, identifier: str) -> Tuple[nn.Module, TokenizerWrapper]:
+        """Load a draft model off the MLX thread, reading its weights in a piece at a time.
+
+        Each piece takes the MLX lock only while it is evaluated, so a generation that is
+        running meanwhile keeps producing tokens between them.
+        """
+        loop = asyncio.get_running_loop()
+        model, tokenizer = await loop.run_in_executor(
+            self._io_exec, partial(self._locked_call, load, identifier, lazy=True)
+        )
+        chunk: List[mx.array] = []
+        chunk_bytes = 0
+        for _, param in tree_flatten(model.parameters()):
+            chunk.append(param)
+            chunk_bytes += param.nbytes
+            if chunk_bytes >= DRAFT_LOAD_CHUNK_BYTES:
+                await loop.run_in_executor(self._io_exec, self._locked_call, mx.eval, chunk)
+                chunk, chunk_bytes = [], 0
+        if chunk:
+            await loop.run_in_executor(self._io_exec, self._locked_call, mx.eval, chunk)
+        return model, tokenizer
+
+    def _detach_draft_model(self):
+        """Stop using the draft model and drop its layers from the prompt cache.
+
+        A generation without it would leave those layers behind the main model's. The
+        model itself stays in _draft_models, so attaching it again is cheap.
+        """
+        if self.prompt_cache is not None:
+            self.prompt_cache = self.prompt_cache[:len(make_prompt_cache(self.model))]  # type: ignore
+        self.draft_model = None
+        self.draft_tokenizer = None
+        self.current_draft_identifier = None
+
+    def _attach_draft_cache_sync(self, draft_model: nn.Module, num_cached_tokens: int):
+        """Blocking: replace the draft part of the prompt cache with one built for draft_model.
+
+        The main model's cache is kept; the draft model only has to process the
+        already-cached tokens, which is cheap next to redoing the main model's prefill.
+        """
+        main_cache = self.prompt_cache[:len(make_prompt_cache(self.model))]  # type: ignore
+        draft_cache = make_prompt_cache(draft_model)
+        cached_tokens = mx.array(np.frombuffer(self.prompt_cache_tokens, dtype=np.int32, count=num_cached_tokens))
+        for start in range(0, num_cached_tokens, DRAFT_PREFILL_STEP):
+            draft_model(cached_tokens[start:start + DRAFT_PREFILL_STEP][None], cache=draft_cache)
+            mx.eval([c.state for c in draft_cache])
+        self.prompt_cache = main_cache + draft_cache
 
     async def get_current_model_info(self) -> Optional[ModelInfo]:
         self._raise_if_unavailable()
         if not self.is_model_loaded() or not self.current_identifier or self.current_config is None:
             return None
 
-        is_local_path = await asyncio.get_running_loop().run_in_executor(
-            None, Path(self.current_identifier).is_dir
+        location = await asyncio.get_running_loop().run_in_executor(
+            self._io_exec, _describe_identifier, self.current_identifier
         )
-        
-        path_str: Optional[str] = None
-        source_type: Literal["local", "hub"]
-
-        if is_local_path:
-            path_obj = Path(self.current_identifier)
-            path_str = await asyncio.get_running_loop().run_in_executor(
-                None, lambda p: str(p.resolve()), path_obj
-            )
-            source_type = "local"
-            model_name = path_obj.name
-        else:
-            path_str = None
-            source_type = "hub"
-            model_name = self.current_identifier
+        return self._make_current_model_info(*location)
 
+    def _make_current_model_info(
+        self, path_str: Optional[str], source_type: Literal["local", "hub"], model_name: str
+    ) -> ModelInfo:
         config_snippet = {
             key: self.current_config.get(key)
             for key in [
@@ -231,160 +793,249 @@ class MLXAdapter:
             config=config_snippet,
         )
 
-    async def list_local_models(self) -> List[ModelInfo]:
+    async def list_local_models(self) -> List[Dict[str, Any]]:
+        """Scan the configured directories for local models.
+
+        Returns plain ModelInfo-shaped dicts; load state (``is_loaded``/``adapter_path``)
+        is filled in by the caller.
+        """
         self._raise_if_unavailable()
-        local_models_list: List[ModelInfo] = []
+        local_models_list: List[Dict[str, Any]] = []
+        seen_ids = set()
         scan_dirs_str = app_config.get(
             "models.scan_directories", [str(DEFAULT_MODELS_SCAN_DIR)]
         )
         loop = asyncio.get_running_loop()
 
         for dir_str in scan_dirs_str:
-            scan_dir = await loop.run_in_executor(
-                None, lambda: Path(dir_str).expanduser().resolve()
-            )
-            if not await loop.run_in_executor(None, scan_dir.is_dir):
+            try:
+                # One executor hop per directory: resolving, stat-ing and reading config.json
+                # files are all sub-millisecond calls that aren't worth a hop each.
+                scan_dir, model_entries = await loop.run_in_executor(self._io_exec, self._scan_dir_sync, dir_str)
+            except OSError as e:
+                logger.error(f"Error scanning directory {dir_str}: {e}")
+                continue
+            if model_entries is None:
                 logger.warning(
                     f"Model scan directory not found or not a directory: {scan_dir}"
                 )
                 continue
-            logger.info(f"Scanning for models in: {scan_dir}")
-            try:
-                items_in_dir = await loop.run_in_executor(
-                    None, list, scan_dir.iterdir()
-                )
-                for item_path_obj in items_in_dir:
-                    if await loop.run_in_executor(None, item_path_obj.is_dir):
-                        has_config = await loop.run_in_executor(
-                            None, (item_path_obj / "config.json").is_file
-                        )
-                        weight_files = await loop.run_in_executor(
-                            None, list, item_path_obj.glob("*.safetensors")
-                        )
-                        has_weights = bool(weight_files)
-                        has_tokenizer_json = await loop.run_in_executor(
-                            None, (item_path_obj / "tokenizer.json").is_file
-                        )
-                        has_tokenizer_model = await loop.run_in_executor(
-                            None, (item_path_obj / "tokenizer.model").is_file
-                        )
-
-                        if (
-                            has_config
-                            and has_weights
-                            and (has_tokenizer_json or has_tokenizer_model)
-                        ):
-                            model_full_path = str(item_path_obj.resolve())
-                            model_display_name = item_path_obj.name
-                            model_config_snippet = {}
-                            try:
-                                config_content = await loop.run_in_executor(
-                                    None, load_config, item_path_obj
-                                )
-                                model_config_snippet = {
-                                    "model_type": config_content.get("model_type"),
-                                    "quantization": config_content.get("quantization"),
-                                    "hidden_size": config_content.get("hidden_size"),
-                                    "num_hidden_layers": config_content.get(
-                                        "num_hidden_layers"
-                                    ),
-                                }
-                            except Exception:
-                                pass
-
-                            is_currently_loaded = (
-                                self.current_identifier == model_full_path
-                                and self.is_model_loaded()
-                            )
-
-                            if not any(
-                                m.id == model_full_path for m in local_models_list
-                            ):
-                                local_models_list.append(
-                                    ModelInfo(
-                                        id=model_full_path,
-                                        name=model_display_name,
-                                        path=model_full_path,
-                                        source="local",
-                                        config=model_config_snippet,
-                                        is_loaded=is_currently_loaded,
-                                        adapter_path=self.current_adapter_path
-                                        if is_currently_loaded
-                                        else None,
-                                    )
-                                )
-            except OSError as e:
-                logger.error(f"Error scanning directory {scan_dir}: {e}")
+            for model_entry in model_entries:
+                if model_entry["id"] not in seen_ids:
+                    seen_ids.add(model_entry["id"])
+                    local_models_list.append(model_entry)
         logger.info(
             f"Finished scanning. Found {len(local_models_list)} potential local models."
         )
         return local_models_list
 
-    async def _update_prompt_cache(
-        self, new_prompt_tokens_list: List[int]
-    ) -> List[int]:
+    def _scan_dir_sync(self, dir_str: str) -> Tuple[Path, Optional[List[Dict[str, Any]]]]:
+        """Blocking: (resolved dir, model entries directly under it), or (dir, None) if it isn't a directory.
+
+        Entries are reused while nothing in the directory has changed. The cache key covers
+        the subdirectories' mtimes as well as the directory's own, so weights that finish
+        downloading into an existing model folder are still picked up.
+        """
+        scan_dir = Path(dir_str).expanduser().resolve()
+        if not scan_dir.is_dir():
+            return scan_dir, None
+        signature = _scan_dir_signature(scan_dir)
+        cached = self._scan_cache.get(scan_dir)
+        if cached is not None and cached[0] == signature:
+            return scan_dir, cached[1]
+
+        logger.info(f"Scanning for models in: {scan_dir}")
+        models: List[Dict[str, Any]] = []
+        for name, _ in signature[1]:
+            model_entry = _local_model_entry(scan_dir / name)
+            if model_entry is not None:
+                models.append(model_entry)
+        self._scan_cache[scan_dir] = (signature, models)
+        return scan_dir, models
+
+    async def _update_prompt_cache(self, new_prompt_tokens_list: Sequence[int]) -> "array[int]":
+        """Reuse as much of the prompt cache as possible; returns the tokens the model still has to process.
+
+        Those are always the tail of prompt_cache_tokens, and are returned as an
+        array('i') slice of it so mx.array() can copy them as one buffer.
+
+        Reuse is decided on token IDs alone, so the model always sees the IDs
+        new_prompt_tokens_list holds: BPE tokens can span the end of the cached text,
+        so encoding only the new characters could produce IDs that encoding the whole
+        prompt never would. The shared token prefix is always kept, trimming the
+        cache back to it where the prompt diverges.
+        """
         self._raise_if_unavailable()
-        loop = asyncio.get_running_loop()
+        suffix_tokens = await self._update_prompt_cache_by_tokens(new_prompt_tokens_list)
+        return await self._tail_to_process(len(suffix_tokens))
 
-        def _blocking_make_cache():
-            new_cache = make_prompt_cache(self.model)
-            if self.draft_model:
-                new_cache += make_prompt_cache(self.draft_model)
-            return new_cache
+    def _cached_tail(self, n: int) -> "array[int]":
+        return self.prompt_cache_tokens[len(self.prompt_cache_tokens) - n:]
 
-        if self.prompt_cache is None:
-            self.prompt_cache = await loop.run_in_executor(None, _blocking_make_cache)
-            self.prompt_cache_tokens = list(new_prompt_tokens_list)
-            return new_prompt_tokens_list
+    async def _tail_to_process(self, n: int) -> "array[int]":
+        """_cached_tail(n), except that a prompt the cache already holds in full gives back its last token.
+
+        mlx-lm needs at least one input token to produce the first logits (e.g. when a
+        prompt is regenerated), so that token is trimmed from the KV cache and processed
+        again; it stays in prompt_cache_tokens.
+        """
+        if n or not self.prompt_cache_tokens:
+            return self._cached_tail(n)
+        if await self._run_mlx(self._trim_kv_cache_sync, self.prompt_cache, 1) == 1:
+            return self._cached_tail(1)
+        logger.debug("Prompt cache can't be trimmed; processing the whole prompt again.")
+        self.prompt_cache = await self._run_mlx(self._make_prompt_cache_sync)
+        return self._cached_tail(len(self.prompt_cache_tokens))
+
+    def _make_prompt_cache_sync(self) -> List[Any]:
+        """Blocking: an empty prompt cache for the model, plus the draft model when one is set."""
+        new_cache = make_prompt_cache(self.model)
+        if self.draft_model:
+            new_cache += make_prompt_cache(self.draft_model)
+        return new_cache
+
+    def _reset_prompt_cache_sync(self) -> List[Any]:
+        """Blocking: the current prompt cache emptied for a new prompt.
+
+        Plain KV caches are rewound in place, so the next prefill writes into their
+        existing buffers instead of freeing them and growing new ones step by step.
+        Anything else is rebuilt: mlx-lm swaps layers for quantized ones during
+        generation, and those shouldn't carry over to a request that didn't ask for it.
+        """
+        cache = self.prompt_cache
+        if cache and all(type(c) is KVCache for c in cache):
+            for c in cache:
+                c.trim(c.offset)
+            return cache
+        return self._make_prompt_cache_sync()
+
+    def _common_token_prefix_len(self, new_tokens: Sequence[int]) -> int:
+        return common_token_prefix_len(self.prompt_cache_tokens, new_tokens)
+
+    def _swap_in_prefix_snapshot_sync(
+        self, new_tokens: Sequence[int], live_match: int
+    ) -> Tuple[int, Optional[List[Any]]]:
+        """Blocking: snapshot the live cache if much of it is about to go, then look for a
+        stored one that shares more than live_match tokens with new_tokens.
+
+        Returns (matched length, restored cache), or (0, None) to keep the live cache.
+        """
+        tag = self.current_draft_identifier
+        if self.prompt_cache is not None and len(self.prompt_cache_tokens) - live_match >= PREFIX_CACHE_MIN_MATCH:
+            self._prefix_store.put(self.prompt_cache_tokens, self.prompt_cache, tag)
+        if not self._prefix_store:
+            return 0, None
+        matched, restored = self._prefix_store.match(new_tokens, tag)
+        return (matched, restored) if matched > live_match else (0, None)
+
+    async def _update_prompt_cache_by_tokens(self, new_prompt_tokens_list: Sequence[int]) -> Sequence[int]:
+        """Like _update_prompt_cache; returns the tokens not yet in the cache."""
         cache_len = len(self.prompt_cache_tokens)
-        prompt_len = len(new_prompt_tokens_list)
         common_prefix_len = 0
-        while (
-            common_prefix_len < min(cache_len, prompt_len)
-            and self.prompt_cache_tokens[common_prefix_len]
-            == new_prompt_tokens_list[common_prefix_len]
-        ):
-            common_prefix_len += 1
-        if common_prefix_len == cache_len:
-            if cache_len == prompt_len:
-                return []
-            else:
+        if self.prompt_cache is not None:
+            common_prefix_len = self._common_token_prefix_len(new_prompt_tokens_list)
+            if common_prefix_len == cache_len:
                 suffix_tokens = new_prompt_tokens_list[common_prefix_len:]
                 self.prompt_cache_tokens.extend(suffix_tokens)
                 return suffix_tokens
-        else:
-            tokens_to_trim = cache_len - common_prefix_len
-            if tokens_to_trim > 0:
-                can_trim = await loop.run_in_executor(
-                    None, can_trim_prompt_cache, self.prompt_cache
-                )
-                if can_trim:
-                    try:
-                        trimmed_count = await loop.run_in_executor(
-                            None, trim_prompt_cache, self.prompt_cache, tokens_to_trim
-                        )
-                        if trimmed_count == tokens_to_trim:
-                            self.prompt_cache_tokens = self.prompt_cache_tokens[
-                                :common_prefix_len
-                            ]
-                            suffix_tokens = new_prompt_tokens_list[common_prefix_len:]
-                            self.prompt_cache_tokens.extend(suffix_tokens)
-                            return suffix_tokens
-                        else:
-                            logger.warning(
-                                f"Cache trim reported {trimmed_count}, expected {tokens_to_trim}. Resetting cache."
-                            )
-                    except Exception as trim_err:
-                        logger.error(
-                            f"Error trimming cache: {trim_err}. Resetting cache."
-                        )
+
+        # Some of the live cache is about to be dropped; an earlier conversation kept in
+        # the prefix store may share more with this prompt.
+        matched, restored = await self._run_mlx(
+            self._swap_in_prefix_snapshot_sync, new_prompt_tokens_list, common_prefix_len
+        )
+        if restored is not None:
+            logger.debug("Resuming from a stored prompt cache that matches %d tokens.", matched)
+            self.prompt_cache = restored
+            self.prompt_cache_tokens = array("i", new_prompt_tokens_list)
+            return new_prompt_tokens_list[matched:]
+
+        if self.prompt_cache is None:
+            self.prompt_cache = await self._run_mlx(self._make_prompt_cache_sync)
+            self.prompt_cache_tokens = array("i", new_prompt_tokens_list)
+            return new_prompt_tokens_list
+        tokens_to_trim = cache_len - common_prefix_len
+        can_trim = await self._run_mlx(can_trim_prompt_cache, self.prompt_cache)
+        if can_trim:
+            try:
+                trimmed_count = await self._run_mlx(trim_prompt_cache, self.prompt_cache, tokens_to_trim)
+                if trimmed_count == tokens_to_trim:
+                    # Truncated in place: only the trimmed tail is touched, not the shared prefix.
+                    del self.prompt_cache_tokens[common_prefix_len:]
+                    suffix_tokens = new_prompt_tokens_list[common_prefix_len:]
+                    self.prompt_cache_tokens.extend(suffix_tokens)
+                    return suffix_tokens
                 else:
-                    logger.debug(
-                        "Current cache type cannot be trimmed. Resetting cache."
+                    logger.warning(
+                        f"Cache trim reported {trimmed_count}, expected {tokens_to_trim}. Resetting cache."
                     )
-            self.prompt_cache = await loop.run_in_executor(None, _blocking_make_cache)
-            self.prompt_cache_tokens = list(new_prompt_tokens_list)
-            return new_prompt_tokens_list
+            except Exception as trim_err:
+                logger.error(
+                    f"Error trimming cache: {trim_err}. Resetting cache."
+                )
+        else:
+            logger.debug(
+                "Current cache type cannot be trimmed. Resetting cache."
+            )
+        self.prompt_cache = await self._run_mlx(self._reset_prompt_cache_sync)
+        self.prompt_cache_tokens = array("i", new_prompt_tokens_list)
+        return new_prompt_tokens_list
+
+    def _on_cache_directory_change(self, cache_dir_str) -> None:
+        self._cache_dir = Path(cache_dir_str or DEFAULT_KV_CACHE_DIR).expanduser().resolve()
+        self._cache_dir_ready = False
+
+    def _kv_cache_path(self, filename_base: str) -> Path:
+        return self._cache_dir / f"{Path(filename_base).stem}.safetensors"
+
+    @staticmethod
+    def _commit_kv_cache_file(tmp_path: Path, save_path: Path) -> None:
+        """Blocking: flush a finished temp file to disk and move it over save_path."""
+        fd = os.open(tmp_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, save_path)
+
+    def _save_kv_cache_sync(
+        self, save_path: Path, prompt_cache: List[Any], metadata: Dict[str, str],
+        bits: Optional[int] = None, group_size: int = 64,
+    ):
+        """Blocking: create the cache directory if needed and serialize the cache to disk.
+
+        With bits set, layers that support it are written as quantized copies; the
+        live cache is left as is. mlx-lm records each layer's cache class in the
+        file, so load_prompt_cache restores quantized layers without extra handling.
+        """
+        if not self._cache_dir_ready:
+            save_path.parent.mkdir(parents=True, exist_ok=True)
+            self._cache_dir_ready = True
+        if bits:
+            prompt_cache = [self._quantized_for_save(c, bits, group_size) for c in prompt_cache]
+        save_prompt_cache(str(save_path), prompt_cache, metadata)
+
+    @staticmethod
+    def _quantized_for_save(layer_cache: Any, bits: int, group_size: int) -> Any:
+        if type(layer_cache).__name__ != "KVCache":
+            return layer_cache  # Already quantized, or a cache type without a quantized form
+        try:
+            return layer_cache.to_quantized(group_size=group_size, bits=bits)
+        except ValueError as e:  # e.g. a head dimension not divisible by group_size
+            logger.warning("Saving a cache layer at full precision: %s", e)
+            return layer_cache
+
+    def _load_kv_cache_sync(self, load_path: Path) -> Optional[Tuple[List[Any], Dict[str, str]]]:
+        """Blocking: read a cache file, or return None when it does not exist."""
+        if not load_path.is_file():
+            return None
+        return load_prompt_cache(str(load_path), True)
+
+    def _trim_kv_cache_sync(self, prompt_cache: List[Any], num_tokens: int) -> Optional[int]:
+        """Blocking: trim the cache, or return None when its type does not support trimming."""
+        if not can_trim_prompt_cache(prompt_cache):
+            return None
+        return trim_prompt_cache(prompt_cache, num_tokens)
 
     async def save_kv_cache(
         self, filename_base: str
@@ -393,32 +1044,42 @@ class MLXAdapter:
         if not self.is_model_loaded() or self.prompt_cache is None:
             return False, "No model or active cache loaded to save.", None
 
-        cache_dir_str = app_config.get(
-            "models.cache_directory", str(DEFAULT_KV_CACHE_DIR)
-        )
-        cache_dir = Path(cache_dir_str).expanduser().resolve()
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, cache_dir.mkdir, True, True)
-        save_path = cache_dir / f"{Path(filename_base).stem}.safetensors"
+        save_path = self._kv_cache_path(filename_base)
+        # Written beside the target and renamed over it once complete, so an interrupted
+        # save never leaves a truncated cache file. It keeps the .safetensors suffix,
+        # which MLX would otherwise append.
+        tmp_path = save_path.with_suffix(".tmp.safetensors")
+        cache_size = len(self.prompt_cache_tokens)
         logger.info(
-            f"Saving KV cache state ({len(self.prompt_cache_tokens)} tokens) to {save_path}"
+            f"Saving KV cache state ({cache_size} tokens) to {save_path}"
         )
         try:
+            # safetensors metadata must be a str -> str mapping.
             metadata = {
-                "model_identifier": self.current_identifier,
-                "adapter_path": self.current_adapter_path,
-                "token_count": len(self.prompt_cache_tokens),
+                "model_identifier": self.current_identifier or "",
+                "adapter_path": self.current_adapter_path or "",
+                "token_count": str(cache_size),
+                "token_ids": _pack_token_ids(self.prompt_cache_tokens),
                 "mlxui_version": __import__("mlxui").__version__,
-                "creation_timestamp": time.time(),
+                "creation_timestamp": str(time.time()),
             }
-            await loop.run_in_executor(
-                None, save_prompt_cache, str(save_path), self.prompt_cache, metadata
+            save_bits = app_config.get("models.kv_cache_save_bits")
+            if save_bits:
+                metadata["kv_bits"] = str(save_bits)
+            await self._run_mlx(
+                self._save_kv_cache_sync, tmp_path, self.prompt_cache, metadata,
+                save_bits, app_config.get("generation.default_kv_cache_options.group_size", 64),
+            )
+            await asyncio.get_running_loop().run_in_executor(
+                self._kv_save_exec, self._commit_kv_cache_file, tmp_path, save_path
             )
-            cache_size = len(self.prompt_cache_tokens)
             logger.info(f"KV cache saved successfully to {save_path}.")
             return True, f"Cache saved to {save_path.name}.", cache_size
         except Exception as e:
             logger.exception(f"Failed to save KV cache to {save_path}:")
+            self._cache_dir_ready = False  # In case the directory was removed; recreate it next time
+            with suppress(OSError):
+                tmp_path.unlink(missing_ok=True)
             return False, f"Failed to save cache: {str(e)}", None
 
     async def load_kv_cache(
@@ -427,22 +1088,14 @@ class MLXAdapter:
         self._raise_if_unavailable()
         if not self.is_model_loaded():
             return False, "Load a model before loading a KV cache.", None
-        cache_dir_str = app_config.get(
-            "models.cache_directory", str(DEFAULT_KV_CACHE_DIR)
-        )
-        cache_dir = Path(cache_dir_str).expanduser().resolve()
-        load_path = cache_dir / f"{Path(filename_base).stem}.safetensors"
+        load_path = self._kv_cache_path(filename_base)
         logger.info(f"Attempting to load KV cache state from {load_path}")
-        if not await asyncio.get_running_loop().run_in_executor(
-            None, load_path.is_file
-        ):
-            logger.error(f"Cache file not found: {load_path}")
-            return False, "Cache file not found.", None
         try:
-            loop = asyncio.get_running_loop()
-            loaded_cache, metadata = await loop.run_in_executor(
-                None, load_prompt_cache, str(load_path), True
-            )
+            loaded = await self._run_mlx(self._load_kv_cache_sync, load_path)
+            if loaded is None:
+                logger.error(f"Cache file not found: {load_path}")
+                return False, "Cache file not found.", None
+            loaded_cache, metadata = loaded
             loaded_model_id = metadata.get("model_identifier")
             if loaded_model_id and loaded_model_id != self.current_identifier:
                 msg = f"Cache model mismatch (Cache: '{loaded_model_id}', Current: '{self.current_identifier}'). Loading anyway."
@@ -452,7 +1105,7 @@ class MLXAdapter:
                     "Loaded cache data is not in the expected list format."
                 )
             self.prompt_cache = loaded_cache
-            self.prompt_cache_tokens = [0] * metadata.get("token_count", 0)
+            self.prompt_cache_tokens = _unpack_token_ids(metadata)
             cache_size = len(self.prompt_cache_tokens)
             logger.info(
                 f"KV cache ({cache_size} tokens) loaded successfully from {load_path}."
@@ -461,28 +1114,23 @@ class MLXAdapter:
         except Exception as e:
             logger.exception(f"Failed to load KV cache from {load_path}:")
             self.prompt_cache = None
-            self.prompt_cache_tokens = []
+            self.prompt_cache_tokens = array("i")
             return False, f"Failed to load cache: {str(e)}", None
 
     async def trim_kv_cache(self, num_tokens: int) -> Tuple[bool, str, Optional[int]]:
         self._raise_if_unavailable()
         if not self.is_model_loaded() or self.prompt_cache is None:
             return False, "No model or active cache loaded to trim.", None
-        logger.info(f"Trimming {num_tokens} tokens from the start of the KV cache.")
+        logger.info(f"Trimming {num_tokens} tokens from the end of the KV cache.")
         try:
-            loop = asyncio.get_running_loop()
-            can_trim = await loop.run_in_executor(
-                None, can_trim_prompt_cache, self.prompt_cache
-            )
-            if not can_trim:
+            trimmed_count = await self._run_mlx(self._trim_kv_cache_sync, self.prompt_cache, num_tokens)
+            if trimmed_count is None:
                 msg = "Current cache type does not support trimming."
                 logger.warning(msg)
                 return False, msg, len(self.prompt_cache_tokens)
-            trimmed_count = await loop.run_in_executor(
-                None, trim_prompt_cache, self.prompt_cache, num_tokens
-            )
             if trimmed_count >= 0:
-                self.prompt_cache_tokens = self.prompt_cache_tokens[trimmed_count:]
+                # mlx-lm trims the most recent tokens; the ones left keep their IDs.
+                del self.prompt_cache_tokens[len(self.prompt_cache_tokens) - trimmed_count:]
                 cache_size = len(self.prompt_cache_tokens)
                 logger.info(
                     f"Successfully trimmed {trimmed_count} tokens. Cache size now: {cache_size} tokens."
@@ -510,60 +1158,45 @@ class MLXAdapter:
             )
             return
 
-        logger.info(
-            f"Generation stream request. Prompt starts: '{request.prompt[:50] if request.prompt else 'N/A'}', Msgs: {len(request.messages) if request.messages else 0}"
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Generation stream request. Prompt starts: '%s', Msgs: %d",
+                request.prompt[:50] if request.prompt else "N/A", len(request.messages) if request.messages else 0,
+            )
         overall_start_time = time.perf_counter()
+        pump_future: Optional[asyncio.Future] = None
         generation_tokens_count = 0
         num_prompt_tokens_for_model = 0 
+        holds_generation_lock = False
 
         try:
             loop = asyncio.get_running_loop()
 
             effective_prompt_str: Optional[str] = None
-            effective_prompt_tokens_list: List[int] = []
+            effective_prompt_tokens_list: Sequence[int] = []
 
             if (
                 request.messages
                 and not request.ignore_chat_template
                 and self.tokenizer.chat_template
             ):
-                logger.debug(
-                    f"Applying chat template to {len(request.messages)} messages."
-                )
+                logger.debug("Applying chat template to %d messages.", len(request.messages))
                 messages_for_template = [
                     msg if isinstance(msg, dict) else msg.model_dump()
                     for msg in request.messages
                 ]  # type: ignore
 
-                def _apply_template_blocking():
-                    return self.tokenizer.apply_chat_template(  # type: ignore
-                        messages_for_template,
-                        tokenize=False,
-                        add_generation_prompt=True,
-                    )
-
-                effective_prompt_str = await loop.run_in_executor(
-                    None, _apply_template_blocking
-                )
-
-                if effective_prompt_str is not None:
-
-                    def _encode_blocking(text_to_encode: str):
-                        return self.tokenizer.encode(text_to_encode)  # type: ignore
+                encoded_chat = await self._encode_chat(messages_for_template)
 
-                    effective_prompt_tokens_list = await loop.run_in_executor(
-                        None, _encode_blocking, effective_prompt_str
-                    )
+                if encoded_chat is not None:
+                    effective_prompt_str, effective_prompt_tokens_list = encoded_chat
                 else:
                     if request.prompt:
                         logger.warning(
                             "Chat template application resulted in None, falling back to raw prompt."
                         )
                         effective_prompt_str = request.prompt
-                        effective_prompt_tokens_list = await loop.run_in_executor(
-                            None, self.tokenizer.encode, request.prompt
-                        )  # type: ignore
+                        effective_prompt_tokens_list = await self._encode(request.prompt)
                     else:
                         raise ValueError(
                             "Chat template application resulted in None, and no raw prompt provided."
@@ -571,25 +1204,21 @@ class MLXAdapter:
             elif request.prompt:
                 logger.debug("Using raw prompt string.")
                 effective_prompt_str = request.prompt
-                effective_prompt_tokens_list = await loop.run_in_executor(
-                    None, self.tokenizer.encode, request.prompt
-                )  # type: ignore
+                effective_prompt_tokens_list = await self._encode(request.prompt)
             else:
                 raise ValueError(
                     "Generation request requires either 'prompt' or 'messages'."
                 )
             initial_prompt_token_count = len(effective_prompt_tokens_list)
-            logger.info(
-                f"Full effective prompt has {initial_prompt_token_count} tokens. Starts: '{effective_prompt_str[:100] if effective_prompt_str else 'N/A'}...'"
-            )
-
-            tokens_to_process_list = await self._update_prompt_cache(
-                effective_prompt_tokens_list
-            )
-            tokens_to_process_mx = mx.array(tokens_to_process_list)
-            num_prompt_tokens_for_model = len(tokens_to_process_list)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "Full effective prompt has %d tokens. Starts: '%s...'",
+                    initial_prompt_token_count, effective_prompt_str[:100] if effective_prompt_str else "N/A",
+                )
 
-            sampler = make_sampler(
+            sampler = self._cached_sampling(
+                self._sampler_cache,
+                make_sampler,
                 temp=request.temperature
                 if request.temperature is not None
                 else app_config.get("generation.default_temp", 1.0),
@@ -628,38 +1257,14 @@ class MLXAdapter:
                 else app_config.get("generation.default_repetition_context_size", 20)
             )
 
-            logits_processors = make_logits_processors(
+            logits_processors = self._cached_sampling(
+                self._logits_processors_cache,
+                make_logits_processors,
                 logit_bias=logit_bias_int_keys,
                 repetition_penalty=repetition_penalty_val,
                 repetition_context_size=repetition_context_size_val,
             )
 
-            active_draft_model = None
-            if request.use_speculative and request.draft_model_identifier:
-                if self.current_draft_identifier != request.draft_model_identifier or self.draft_model is None:
-                    logger.info(f"Loading draft model for speculative decoding: {request.draft_model_identifier}")
-                    try:
-                        load_draft_fn_with_kwargs = partial(load, lazy=False)
-                        draft_model_instance, draft_tokenizer_instance = await loop.run_in_executor(
-                            None, load_draft_fn_with_kwargs, request.draft_model_identifier
-                        )
-                        if draft_tokenizer_instance.vocab_size != self.tokenizer.vocab_size: # type: ignore
-                             logger.warning("Draft model tokenizer vocab size mismatch!")
-                        self.draft_model = draft_model_instance
-                        self.draft_tokenizer = draft_tokenizer_instance
-                        self.current_draft_identifier = request.draft_model_identifier
-                        self.prompt_cache = None
-                        tokens_to_process_list = await self._update_prompt_cache(
-                            effective_prompt_tokens_list
-                        )
-                        tokens_to_process_mx = mx.array(tokens_to_process_list)
-                        num_prompt_tokens_for_model = len(tokens_to_process_list)
-                    except Exception as e:
-                         logger.error(f"Failed to load draft model '{request.draft_model_identifier}': {e}. Disabling spec decoding.")
-                         self.draft_model = None; self.current_draft_identifier = None
-                active_draft_model = self.draft_model
-            elif not request.use_speculative and self.draft_model is not None: active_draft_model = None
-
             kv_bits: Optional[int] = app_config.get(
                 "generation.default_kv_cache_options.bits"
             )
@@ -675,6 +1280,13 @@ class MLXAdapter:
                     kv_bits = request.kv_cache_options.bits
                 if request.kv_cache_options.group_size is not None: kv_group_size = request.kv_cache_options.group_size
                 if request.kv_cache_options.quantized_kv_start is not None: kv_quantized_start = request.kv_cache_options.quantized_kv_start
+            # The long-context default only applies when nothing asked for a bit width;
+            # batched decoding keeps full-precision caches, so it doesn't rule that out.
+            requested_kv_bits = kv_bits
+            if kv_bits is None and self._default_kv_quant:
+                kv_bits = self._default_kv_quant["kv_bits"]
+                kv_group_size = self._default_kv_quant["kv_group_size"]
+                kv_quantized_start = self._default_kv_quant["quantized_kv_start"]
 
             max_tokens_val = (
                 request.max_tokens
@@ -682,7 +1294,79 @@ class MLXAdapter:
                 else app_config.get("generation.default_max_tokens", 4096)
             )
 
-            logger.info(f"Calling mlx_lm.stream_generate with {num_prompt_tokens_for_model} effective prompt tokens.")
+            stream_batch_size = max(1, (
+                request.stream_batch_size
+                if request.stream_batch_size is not None
+                else app_config.get("generation.stream_batch_size", 4)
+            ))
+            max_batch_size = app_config.get("generation.max_batch_size", 4)
+            if (
+                self._generation_lock.locked()
+                and max_batch_size > 1
+                and self._batchable
+                and effective_prompt_tokens_list
+                and not request.use_speculative
+                and requested_kv_bits is None
+            ):
+                # Another generation holds the model: decode alongside the other queued requests.
+                batched = False
+                async with aclosing(self._batch_scheduler.stream(
+                    effective_prompt_tokens_list, sampler, logits_processors, max_tokens_val, stream_batch_size
+                )) as batched_chunks:
+                    async for chunk in batched_chunks:
+                        batched = True
+                        yield chunk
+                if batched:
+                    return
+                # Nothing else was waiting: run on the normal path, with the prompt cache.
+
+            await self._generation_lock.acquire()
+            holds_generation_lock = True
+            self.generation_in_progress = True
+            if mx.metal.is_available():
+                # Peak memory reported by the performance stream is per generation.
+                (getattr(mx, "reset_peak_memory", None) or mx.metal.reset_peak_memory)()
+
+            tokens_to_process_list = await self._update_prompt_cache(effective_prompt_tokens_list)
+            tokens_to_process_mx = mx.array(tokens_to_process_list)  # Copied as one int32 buffer
+            num_prompt_tokens_for_model = len(tokens_to_process_list)
+
+            active_draft_model = None
+            if request.use_speculative and request.draft_model_identifier:
+                if self.current_draft_identifier != request.draft_model_identifier or self.draft_model is None:
+                    draft_task = self._get_draft_model(request.draft_model_identifier)
+                    if not draft_task.done():
+                        # Don't hold up the first token on the draft model's weights; this request
+                        # runs without it and a later one picks it up once it has loaded.
+                        logger.info(
+                            "Draft model '%s' is still loading; generating without it.", request.draft_model_identifier
+                        )
+                    else:
+                        try:
+                            draft_model_instance, draft_tokenizer_instance = draft_task.result()
+                            if draft_tokenizer_instance.vocab_size != self.tokenizer.vocab_size: # type: ignore
+                                 logger.warning("Draft model tokenizer vocab size mismatch!")
+                            self.draft_model = draft_model_instance
+                            self.draft_tokenizer = draft_tokenizer_instance
+                            self.current_draft_identifier = request.draft_model_identifier
+                            num_cached_tokens = len(self.prompt_cache_tokens) - len(tokens_to_process_list)
+                            if self.prompt_cache is not None and UNKNOWN_TOKEN not in self.prompt_cache_tokens:
+                                # Token IDs are known (the cache wasn't loaded from a file): keep the main
+                                # model's cache and give the new draft model a cache of its own.
+                                await self._run_mlx(self._attach_draft_cache_sync, draft_model_instance, num_cached_tokens)
+                            else:
+                                self.prompt_cache = None
+                                tokens_to_process_list = await self._update_prompt_cache(effective_prompt_tokens_list)
+                                tokens_to_process_mx = mx.array(tokens_to_process_list)
+                                num_prompt_tokens_for_model = len(tokens_to_process_list)
+                        except Exception as e:
+                             logger.error("Failed to load draft model '%s': %s. Disabling spec decoding.", request.draft_model_identifier, e)
+                if self.current_draft_identifier == request.draft_model_identifier:
+                    active_draft_model = self.draft_model
+            if active_draft_model is None and self.draft_model is not None:
+                self._detach_draft_model()
+
+            logger.info("Calling mlx_lm.stream_generate with %d effective prompt tokens.", num_prompt_tokens_for_model)
             
             partial_stream_generate = partial(
                 stream_generate,
@@ -701,52 +1385,151 @@ class MLXAdapter:
                 kv_group_size=kv_group_size,
                 quantized_kv_start=kv_quantized_start,
             )
-            generation_iterator = await loop.run_in_executor(None, partial_stream_generate) # type: ignore
-            
-            last_chunk_for_final_yield: Optional[TokenChunk] = None
-
-            for mlx_response in generation_iterator: 
-                if not isinstance(mlx_response, MLXInternalGenerationResponse):
-                    logger.warning(f"Unexpected type from stream_generate: {type(mlx_response)}"); continue
-                
-                self.prompt_cache_tokens.append(mlx_response.token)
-                generation_tokens_count += 1
-                self.last_generation_tps = mlx_response.generation_tps
-
-                chunk = TokenChunk(
-                    text=mlx_response.text,
-                    is_finished=(mlx_response.finish_reason is not None),
-                    finish_reason=mlx_response.finish_reason, # type: ignore
-                    token_count=1, token=mlx_response.token,
-                    from_draft=getattr(mlx_response, 'from_draft', False),
-                    prompt_tokens=initial_prompt_token_count,
-                    generation_tokens=generation_tokens_count,
-                    generation_tps=mlx_response.generation_tps
-                )
-                last_chunk_for_final_yield = chunk
-                yield chunk
-                if chunk.is_finished: logger.info(f"Gen stream finished by model. Reason: {chunk.finish_reason}"); break
-            else:
-                if generation_tokens_count >= max_tokens_val:
-                    logger.info(f"Gen finished: max_tokens ({max_tokens_val}) reached.")
-                    if not (
-                        last_chunk_for_final_yield
-                        and last_chunk_for_final_yield.is_finished
-                    ):
-                        yield TokenChunk(
-                            text="",
-                            is_finished=True,
-                            finish_reason="length",
-                            prompt_tokens=initial_prompt_token_count,
+            generation_iterator = await self._run_mlx(partial_stream_generate) # type: ignore
+
+            # Decoding runs on the MLX thread and hands chunks over through a bounded queue,
+            # so the event loop keeps serving other connections while tokens are computed.
+            # Chunks cross over in groups: one thread hop per stream_batch_size tokens, or per
+            # stream_flush_interval_ms worth of tokens when decoding is slower than that.
+            chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=GENERATION_QUEUE_SIZE)
+            stop_pump = threading.Event()
+            stream_flush_interval = (
+                request.stream_flush_interval_ms
+                if request.stream_flush_interval_ms is not None
+                else app_config.get("generation.stream_flush_interval_ms", 20)
+            ) / 1000
+
+            def _put(item) -> bool:
+                # Blocks while the queue is full; gives up once the consumer has gone away.
+                put_future = asyncio.run_coroutine_threadsafe(chunk_queue.put(item), loop)
+                while True:
+                    try:
+                        put_future.result(timeout=0.1)
+                        return True
+                    except concurrent.futures.TimeoutError:
+                        if stop_pump.is_set():
+                            put_future.cancel()
+                            return False
+
+            def _pump():
+                nonlocal generation_tokens_count
+                last_chunk_for_final_yield: Optional[TokenChunk] = None
+                # Tokens already in the KV cache but not yet in prompt_cache_tokens; always
+                # flushed before the pump returns, which stream_generate waits for.
+                token_buf = array("i")
+                pending: List[TokenChunk] = []
+                # Bound once: the loop body runs for every decoded token.
+                buffer_token = token_buf.append
+                is_stopping = stop_pump.is_set
+                try:
+                    for mlx_response in self._locked_steps(generation_iterator):
+                        if not isinstance(mlx_response, MLXInternalGenerationResponse):
+                            logger.warning("Unexpected type from stream_generate: %s", type(mlx_response)); continue
+                        token = mlx_response.token
+                        text = mlx_response.text
+                        finish_reason = mlx_response.finish_reason
+                        tps = mlx_response.generation_tps
+
+                        # The closing "length" response repeats the last token, which is already
+                        # recorded; every other token (including a final EOS) went through the cache.
+                        if finish_reason != "length":
+                            buffer_token(token)
+                            if len(token_buf) >= TOKEN_FLUSH_SIZE:
+                                self.prompt_cache_tokens.extend(token_buf)
+                                del token_buf[:]
+                        generation_tokens_count += 1
+                        self.last_generation_tps = tps
+                        if is_stopping():
+                            return  # Recorded above: the token is already in the KV cache.
+
+                        chunk = TokenChunk(
+                            text=text,
+                            is_finished=finish_reason is not None,
+                            finish_reason=finish_reason, # type: ignore
+                            token_count=1, token=token,
+                            from_draft=mlx_response.from_draft,
+                            # Constant for the stream: only sent with the first and the final chunk.
+                            prompt_tokens=initial_prompt_token_count
+                            if generation_tokens_count == 1 or finish_reason is not None
+                            else None,
                             generation_tokens=generation_tokens_count,
-                            generation_tps=self.last_generation_tps,
+                            generation_tps=tps
                         )
+                        last_chunk_for_final_yield = chunk
+                        pending.append(chunk)
+                        # How long the group has been waiting is estimated from mlx-lm's decode
+                        # rate rather than read from the clock on every token. The first token
+                        # always goes out at once; the rate isn't meaningful for it yet anyway.
+                        if (
+                            finish_reason is not None
+                            or len(pending) >= stream_batch_size
+                            or generation_tokens_count == 1
+                            or len(pending) >= stream_flush_interval * tps
+                        ):
+                            # The group's last chunk carries the running counts for all of it.
+                            for earlier in pending[:-1]:
+                                earlier.generation_tokens = earlier.generation_tps = None
+                            if not _put(pending):
+                                return
+                            pending = []
+                        if finish_reason is not None: logger.info("Gen stream finished by model. Reason: %s", finish_reason); break
+                    else:
+                        if generation_tokens_count >= max_tokens_val:
+                            logger.info("Gen finished: max_tokens (%d) reached.", max_tokens_val)
+                            if not (
+                                last_chunk_for_final_yield
+                                and last_chunk_for_final_yield.is_finished
+                            ):
+                                pending.append(TokenChunk(
+                                    text="",
+                                    is_finished=True,
+                                    finish_reason="length",
+                                    prompt_tokens=initial_prompt_token_count,
+                                    generation_tokens=generation_tokens_count,
+                                    generation_tps=self.last_generation_tps,
+                                ))
+                except Exception as e:
+                    if pending and _put(pending):
+                        pending = []
+                    _put(e)  # Re-raised on the event loop side
+                finally:
+                    self.prompt_cache_tokens.extend(token_buf)
+                    if pending and not stop_pump.is_set():
+                        _put(pending)
+                    _put(None)
+
+            pump_future = loop.run_in_executor(self._mlx_exec, _pump)
+            while True:
+                item = await chunk_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                for chunk in item:
+                    yield chunk
         except ValueError as e:
-             logger.error(f"Config error during generation: {e}")
+             logger.error("Config error during generation: %s", e)
              yield TokenChunk(text="", is_finished=True, error=str(e), finish_reason="error")
         except Exception as e:
             logger.exception("Unhandled error during generation stream:")
             yield TokenChunk(text="", is_finished=True, error=f"Generation failed: {str(e)}", finish_reason="error")
         finally:
+            try:
+                if pump_future is not None:
+                    stop_pump.set()
+                    try:
+                        await pump_future  # Cache state is only consistent once the pump has stopped.
+                    except Exception:
+                        pass
+            finally:
+                # Also reached when the await above is cancelled (a cancelled task scope re-raises
+                # at every await). The pump has been told to stop, and work queued behind it on
+                # the MLX thread still runs after it, so the lock can go.
+                if holds_generation_lock:
+                    self.generation_in_progress = False
+                    self._generation_lock.release()
             total_duration = time.perf_counter() - overall_start_time
-            logger.info(f"Stream generation took {total_duration:.2f}s. Processed {num_prompt_tokens_for_model} prompt tokens, Generated {generation_tokens_count} tokens.")
\ No newline at end of file
+            logger.info(
+                "Stream generation took %.2fs. Processed %d prompt tokens, Generated %d tokens.",
+                total_duration, num_prompt_tokens_for_model, generation_tokens_count,
+            )
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+Snapshots of earlier prompt caches, so a prompt that returns to an older conversation
+(or shares a long system prompt with one) only prefills the tokens that are new.
+
+The adapter keeps one live prompt cache. Before it trims or discards that cache for a
+different prompt, it stores a snapshot here; a later prompt that shares more with a
+snapshot than with the live cache resumes from the snapshot instead.
+
+Snapshots are stored as chains of fixed-size token blocks, each keyed by a hash of its
+tokens and of the block before it. Conversations that share a prefix share its blocks,
+and eviction drops least recently used blocks from the ends of chains, so the shared
+beginning of a conversation outlives its tail. Blocks are stored quantized
+(generation.prefix_cache_kv_bits) and dequantized again when resumed, so the live
+cache stays at full precision.
+"""
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import mlx.core as mx
+import numpy as np
+
+try:
+    from mlx_lm.models.cache import KVCache
+except ImportError:  # The adapter reports the missing library; the store is never used without it.
+    KVCache = None
+
+from ..config import config as app_config
+
+logger = logging.getLogger("mlxui.backend.core.prefix_cache")
+
+# Token prefixes shorter than this are compared in Python; numpy setup costs more than it saves.
+NUMPY_PREFIX_MIN_LEN = 256
+# Shorter shared prefixes aren't worth swapping the live cache for.
+PREFIX_CACHE_MIN_MATCH = 64
+# Tokens per stored block. Large enough that resuming a long prefix concatenates few arrays.
+PREFIX_CACHE_BLOCK_SIZE = 256
+
+def common_token_prefix_len(cached: "array[int]", new_tokens: Sequence[int]) -> int:
+    """Length of the longest common prefix of two token ID sequences."""
+    n = min(len(cached), len(new_tokens))
+    if n < NUMPY_PREFIX_MIN_LEN:
+        i = 0
+        while i < n and cached[i] == new_tokens[i]:
+            i += 1
+        return i
+    if not isinstance(new_tokens, array):
+        new_tokens = array("i", new_tokens)
+    # Zero-copy views; they must not outlive this call, since they pin the arrays' sizes.
+    cached_view = np.frombuffer(cached, dtype=np.int32, count=n)
+    incoming = np.frombuffer(new_tokens, dtype=np.int32, count=n)
+    diff = np.not_equal(cached_view, incoming)
+    del cached_view, incoming
+    return int(diff.argmax()) if diff.any() else n
+
+def is_snapshottable(prompt_cache: Optional[List[Any]]) -> bool:
+    """Only plain KV caches can be cut at an arbitrary position and resumed from."""
+    return bool(prompt_cache) and all(type(c) is KVCache for c in prompt_cache)
+
+@dataclass
+class _Block:
+    # This block's token IDs: PREFIX_CACHE_BLOCK_SIZE of them, or fewer at the end of a chain.
+    tokens: "array[int]"
+    parent: bytes
+    # Per layer (keys, values); with bits set, each is mx.quantize's (weights, scales, biases).
+    states: List[Tuple[Any, Any]]
+    nbytes: int
+    bits: Optional[int] = None
+    group_size: int = 64
+
+def _quantize_states(states: List[Tuple[mx.array, mx.array]], bits: int, group_size: int) -> List[Tuple[Any, Any]]:
+    quantized = [
+        (mx.quantize(k, group_size=group_size, bits=bits), mx.quantize(v, group_size=group_size, bits=bits))
+        for k, v in states
+    ]
+    # Evaluated now, so the block no longer holds on to the full-precision buffers.
+    mx.eval(quantized)
+    return quantized
+
+def _copy_states(states: List[Tuple[mx.array, mx.array]]) -> List[Tuple[mx.array, mx.array]]:
+    # Slices are views that would keep the live cache's whole (step-padded) buffers alive;
+    # copies own just the block's tokens, so its nbytes is what evicting it frees.
+    copied = [(mx.contiguous(k), mx.contiguous(v)) for k, v in states]
+    mx.eval(copied)
+    return copied
+
+def _nbytes(part: Any) -> int:
+    return sum(a.nbytes for a in part) if isinstance(part, tuple) else part.nbytes
+
+def _block_key(parent: bytes, tokens: "array[int]") -> bytes:
+    return hashlib.blake2b(parent + tokens.tobytes(), digest_size=16).digest()
+
+def _root_key(tag: Any) -> bytes:
+    # Chains for different tags (e.g. with and without a draft model's layers) never meet.
+    return hashlib.blake2b(repr(tag).encode(), digest_size=16, person=b"mlxui-root").digest()
+
+class PrefixCacheStore:
+    """Recently used prompt cache blocks, bounded by generation.prefix_cache_max_mb."""
+
+    def __init__(self):
+        self._blocks: "OrderedDict[bytes, _Block]" = OrderedDict()
+        self._children: Dict[bytes, Set[bytes]] = {}
+        self._nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def clear(self) -> None:
+        self._blocks.clear()
+        self._children.clear()
+        self._nbytes = 0
+
+    def put(self, tokens: "array[int]", prompt_cache: List[Any], tag: Any = None) -> None:
+        """Blocking: remember prompt_cache, which holds the KV state for tokens.
+
+        Blocks already stored for the same prefix are reused; a shorter final block that
+        the new one extends is dropped, since the new one serves every prompt it would.
+        """
+        max_bytes = int(app_config.get("generation.prefix_cache_max_mb", 1024)) * 1024 * 1024
+        n = len(tokens)
+        if n < PREFIX_CACHE_MIN_MATCH or max_bytes <= 0 or not is_snapshottable(prompt_cache):
+            return
+        if any(c.offset != n for c in prompt_cache):
+            return  # Out of step with the token list (e.g. mid-trim); not safe to resume from.
+        bits = app_config.get("generation.prefix_cache_kv_bits", 8)
+        group_size = app_config.get("generation.default_kv_cache_options.group_size", 64)
+        tokens = array("i", tokens)
+        parent = _root_key(tag)
+        added = 0
+        for start in range(0, n, PREFIX_CACHE_BLOCK_SIZE):
+            end = min(n, start + PREFIX_CACHE_BLOCK_SIZE)
+            block_tokens = tokens[start:end]
+            key = _block_key(parent, block_tokens)
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+            else:
+                self._drop_superseded(parent, block_tokens)
+                states = [(c.keys[..., start:end, :], c.values[..., start:end, :]) for c in prompt_cache]
+                block_bits = bits or None
+                if block_bits:
+                    try:
+                        states = _quantize_states(states, block_bits, group_size)
+                    except ValueError as e:  # e.g. a head dimension not divisible by group_size
+                        logger.debug("Keeping a prompt cache block at full precision: %s", e)
+                        block_bits = None
+                if not block_bits:
+                    states = _copy_states(states)
+                nbytes = sum(_nbytes(k) + _nbytes(v) for k, v in states)
+                self._blocks[key] = _Block(block_tokens, parent, states, nbytes, block_bits, group_size)
+                self._children.setdefault(parent, set()).add(key)
+                self._nbytes += nbytes
+                added += 1
+            parent = key
+        self._evict(max_bytes)
+        logger.debug(
+            "Stored a %d-token prompt cache snapshot (%d new blocks, %d held, %.1f MB).",
+            n, added, len(self._blocks), self._nbytes / (1024 * 1024),
+        )
+
+    def match(self, tokens: Sequence[int], tag: Any = None) -> Tuple[int, Optional[List[Any]]]:
+        """Blocking: (matched length, a fresh prompt cache holding that many tokens) for the
+        stored chain sharing the longest prefix with tokens, or (0, None)."""
+        parent = _root_key(tag)
+        path: List[Tuple[_Block, int]] = []
+        matched = 0
+        while matched < len(tokens):
+            best_key, best_len = None, 0
+            for key in self._children.get(parent, ()):
+                block = self._blocks[key]
+                shared = common_token_prefix_len(block.tokens, tokens[matched:matched + len(block.tokens)])
+                if shared > best_len:
+                    best_key, best_len = key, shared
+            if best_key is None:
+                break
+            block = self._blocks[best_key]
+            path.append((block, best_len))
+            matched += best_len
+            self._blocks.move_to_end(best_key)
+            if best_len < PREFIX_CACHE_BLOCK_SIZE:
+                break  # Diverged inside this block, or it ends the chain.
+            parent = best_key
+        if matched < PREFIX_CACHE_MIN_MATCH:
+            return 0, None
+
+        def _restore(block: _Block, part: Any, length: int) -> mx.array:
+            if block.bits is None:
+                return part[..., :length, :]
+            # Dequantized lazily: the work happens as part of the next prefill.
+            return mx.dequantize(
+                *(a[..., :length, :] for a in part), group_size=block.group_size, bits=block.bits
+            )
+
+        def _join(parts: List[mx.array]) -> mx.array:
+            return parts[0] if len(parts) == 1 else mx.concatenate(parts, axis=2)
+
+        restored = []
+        for layer in range(len(path[0][0].states)):
+            keys = [_restore(block, block.states[layer][0], length) for block, length in path]
+            values = [_restore(block, block.states[layer][1], length) for block, length in path]
+            cache = KVCache()
+            cache.state = (_join(keys), _join(values))
+            restored.append(cache)
+        return matched, restored
+
+    def _drop_superseded(self, parent: bytes, block_tokens: "array[int]") -> None:
+        """Drop shorter final blocks under parent that block_tokens starts with."""
+        for key in list(self._children.get(parent, ())):
+            block = self._blocks[key]
+            if (
+                len(block.tokens) < len(block_tokens)
+                and not self._children.get(key)
+                and common_token_prefix_len(block.tokens, block_tokens) == len(block.tokens)
+            ):
+                self._drop(key)
+
+    def _evict(self, max_bytes: int) -> None:
+        """Drop least recently used blocks that end a chain until the store fits max_bytes."""
+        while self._nbytes > max_bytes and self._blocks:
+            key = next(k for k in self._blocks if not self._children.get(k))
+            self._drop(key)
+
+    def _drop(self, key: bytes) -> None:
+        block = self._blocks.pop(key)
+        self._nbytes -= block.nbytes
+        self._children.pop(key, None)
+        siblings = self._children.get(block.parent)
+        if siblings is not None:
+            siblings.discard(key)
+            if not siblings:
+                del self._children[block.parent]
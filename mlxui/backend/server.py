@@ -1,5 +1,8 @@
 # mlxui/mlxui/backend/server.py
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
@@ -9,6 +12,7 @@ from mlxui.backend.api.models import router as models_router
 from mlxui.backend.api.generation import router as generation_router
 from mlxui.backend.api.performance import router as performance_router
 from mlxui.backend.api.config import router as config_router
+from mlxui.backend.core.mlx_adapter import io_thread_count, shutdown_mlx_adapter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,17 +20,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger("mlxui.backend.server")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Default-executor work (run_in_executor(None, ...), asyncio.to_thread) gets the same small pool as the
+    # adapter, instead of Python's min(32, cpus + 4) threads.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=io_thread_count(), thread_name_prefix="mlxui-default")
+    )
+    yield
+    await shutdown_mlx_adapter()
+
 app = FastAPI(
     title="MLXUI API",
     description="API for the MLXUI application, a direct frontend for mlx-lm models.",
     version=__import__('mlxui').__version__,
+    lifespan=lifespan,
 )
 
 # Configure CORS
-# Allow all origins for development, restrict in production.
+# The bundled UI reaches the API through the Vite dev server's proxy, so only its own origin
+# is listed; add others (or "*") under app.cors_origins. Read once at startup.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], # Or specify your frontend URL: ["http://localhost:3000"]
+    allow_origins=app_config.get("app.cors_origins", ["http://localhost:3000", "http://127.0.0.1:3000"]),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
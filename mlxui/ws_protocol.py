@@ -0,0 +1,27 @@
+"""
+WebSocket protocol for the uvicorn server with a larger transport write buffer.
+
+The default asyncio high-water mark (64 KiB) pauses writers as soon as a client
+falls slightly behind, so every small token or metrics frame ends up waiting on
+a drain. Letting the kernel and transport absorb up to WS_WRITE_BUFFER_HIGH
+removes those spurious waits. The trade-off is that a stalled client is noticed
+later: sends only block (and trip the stall timeouts in the API routers) once
+that much data is queued for it.
+"""
+import asyncio
+
+from uvicorn.protocols.websockets.auto import AutoWebSocketsProtocol
+
+WS_WRITE_BUFFER_HIGH = 1024 * 1024  # 1 MiB
+
+if AutoWebSocketsProtocol is not None:
+
+    class WideBufferWebSocketProtocol(AutoWebSocketsProtocol):  # type: ignore[misc, valid-type]
+        def connection_made(self, transport: asyncio.BaseTransport) -> None:
+            super().connection_made(transport)  # type: ignore[arg-type]
+            if isinstance(transport, asyncio.WriteTransport):
+                transport.set_write_buffer_limits(high=WS_WRITE_BUFFER_HIGH)
+
+else:
+    # Neither websockets nor wsproto is installed; uvicorn will report that itself.
+    WideBufferWebSocketProtocol = None  # type: ignore[assignment, misc]
@@ -1,5 +1,4 @@
 import os
-import re
 from setuptools import setup, find_packages
 from pathlib import Path
 
@@ -20,11 +19,10 @@ def get_version():
         raise RuntimeError(f"Version file not found: {version_file}")
 
     with open(version_file, "r", encoding="utf-8") as f:
-        version_match = re.search(
-            r"^__version__\s*=\s*['\"]([^'\"]*)['\"]", f.read(), re.M
-        )
-    if version_match:
-        return version_match.group(1)
+        for line in f:
+            name, sep, value = line.partition("=")
+            if sep and name.strip() == "__version__":
+                return value.strip().strip("'\"")
     raise RuntimeError("Unable to find version string in __init__.py.")
 
 
@@ -1,6 +1,6 @@
 import asyncio
 import websockets
-import json
+import orjson
 
 async def test_generation_stream():
     uri = "ws://127.0.0.1:8000/api/generate/ws" # Ensure port matches your backend
@@ -15,21 +15,29 @@ async def test_generation_stream():
     try:
         async with websockets.connect(uri) as websocket:
             print(f"Connected to {uri}")
-            await websocket.send(json.dumps(generation_request))
+            await websocket.send(orjson.dumps(generation_request))
             print(f"Sent request: {generation_request['prompt'][:30]}...")
 
             while True:
-                message_str = await websocket.recv()
-                chunk = json.loads(message_str)
-                
-                if chunk.get("error"):
-                    print(f"\nError from server: {chunk['error']}")
-                    break
-                
-                print(chunk.get("text", ""), end="", flush=True)
-                
-                if chunk.get("is_finished"):
-                    print(f"\nStream finished. Reason: {chunk.get('finish_reason')}")
+                message = await websocket.recv()
+                payload = orjson.loads(message)
+                # Frames carry a single chunk or an array of coalesced chunks.
+                chunks = payload if isinstance(payload, list) else [payload]
+
+                done = False
+                for chunk in chunks:
+                    if chunk.get("error"):
+                        print(f"\nError from server: {chunk['error']}")
+                        done = True
+                        break
+
+                    print(chunk.get("text", ""), end="", flush=True)
+
+                    if chunk.get("is_finished"):
+                        print(f"\nStream finished. Reason: {chunk.get('finish_reason')}")
+                        done = True
+                        break
+                if done:
                     break
     except websockets.exceptions.ConnectionClosedOK:
         print("\nConnection closed normally by server.")
@@ -0,0 +1,75 @@
+"""Coalesced encoding must give the IDs the tokenizer's own encode gives."""
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from mlxui.backend.core.batch_encoder import BatchEncoder, batch_encoder_for
+
+
+class _Backend:
+    """Stands in for a `tokenizers.Tokenizer`: one ID per character."""
+
+    def encode(self, text, add_special_tokens=True):
+        return SimpleNamespace(ids=[ord(c) for c in text])
+
+    def encode_batch(self, texts, add_special_tokens=True):
+        return [self.encode(text) for text in texts]
+
+
+class _PreprocessingTokenizer:
+    """A wrapper that lowercases before encoding, so the backend alone gives other IDs."""
+
+    def __init__(self):
+        self._tokenizer = SimpleNamespace(_tokenizer=_Backend())
+
+    def encode(self, text, add_special_tokens=True):
+        return self._tokenizer._tokenizer.encode(text.lower()).ids
+
+
+class BatchEncoderForTest(unittest.TestCase):
+    def test_slow_path_keeps_wrapper_preprocessing(self):
+        tokenizer = _PreprocessingTokenizer()
+        encode_batch = batch_encoder_for(tokenizer, tokenizer.encode, False)
+        self.assertEqual(encode_batch(["AB", "c"], True), [[97, 98], [99]])
+
+    def test_fast_path_uses_backend_batch(self):
+        tokenizer = _PreprocessingTokenizer()
+        backend = tokenizer._tokenizer._tokenizer
+        encode_batch = batch_encoder_for(tokenizer, lambda text, add_special_tokens=True: backend.encode(text).ids, True)
+        self.assertEqual(encode_batch(["AB"], True), [[65, 66]])
+
+
+class BatchEncoderTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.calls = []
+
+        def encode_batch(texts, add_special_tokens):
+            self.calls.append(list(texts))
+            return [[len(text), int(add_special_tokens)] for text in texts]
+
+        self.encoder = BatchEncoder(self.executor)
+        self.encoder.set_encoder(encode_batch)
+
+    async def asyncTearDown(self):
+        self.executor.shutdown(wait=True)
+
+    async def test_concurrent_texts_are_encoded_together(self):
+        results = await asyncio.gather(
+            self.encoder.encode("a"),
+            self.encoder.encode("bb"),
+            self.encoder.encode("bb"),
+            self.encoder.encode("ccc", add_special_tokens=False),
+        )
+        self.assertEqual(results, [[1, 1], [2, 1], [2, 1], [3, 0]])
+        self.assertEqual(self.calls, [["a", "bb"], ["ccc"]])
+
+    async def test_no_encoder_raises(self):
+        self.encoder.set_encoder(None)
+        with self.assertRaises(RuntimeError):
+            await self.encoder.encode("a")
+
+
+if __name__ == "__main__":
+    unittest.main()
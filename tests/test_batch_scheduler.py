@@ -0,0 +1,137 @@
+"""Padded-batch decoding must give every request the tokens it would get on its own."""
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import mlx.core as mx
+import mlx.nn as nn
+
+from mlxui.backend.core.mlx_adapter import MLXAdapter, MLX_LM_AVAILABLE
+
+if MLX_LM_AVAILABLE:
+    from mlx_lm.models import llama
+    from mlx_lm.models.cache import RotatingKVCache, make_prompt_cache
+
+    from mlxui.backend.core.batch_scheduler import BatchScheduler, _prefill_mask, can_batch
+
+
+def _tiny_llama():
+    mx.random.seed(0)
+    model = llama.Model(llama.ModelArgs(
+        model_type="llama", hidden_size=64, num_hidden_layers=2, intermediate_size=128,
+        num_attention_heads=4, num_key_value_heads=2, rms_norm_eps=1e-5, vocab_size=97,
+    ))
+    mx.eval(model.parameters())
+    return model
+
+
+class _Detokenizer:
+    """One character per token, enough to check what each row was sent."""
+
+    def __init__(self, tokenizer):
+        self.reset()
+
+    def reset(self):
+        self.last_segment = ""
+
+    def add_token(self, token):
+        self.last_segment = chr(ord("a") + token % 26)
+
+    def finalize(self):
+        pass
+
+
+def _greedy(logprobs):
+    return mx.argmax(logprobs, axis=-1)
+
+
+@unittest.skipUnless(MLX_LM_AVAILABLE, "mlx-lm is not installed")
+class PrefillMaskTest(unittest.TestCase):
+    def test_hides_left_padding(self):
+        pads = mx.array([0, 2])[:, None, None]
+        mask = _prefill_mask(pads, 0, 4)
+        self.assertEqual(mask.shape, (2, 1, 4, 4))
+        causal = [[True, False, False, False],
+                  [True, True, False, False],
+                  [True, True, True, False],
+                  [True, True, True, True]]
+        self.assertEqual(mask[0, 0].tolist(), causal)
+        # Padding positions see only themselves; real positions skip the padding.
+        self.assertEqual(mask[1, 0].tolist(), [[True, False, False, False],
+                                               [False, True, False, False],
+                                               [False, False, True, False],
+                                               [False, False, True, True]])
+
+    def test_later_prefill_steps_cover_earlier_keys(self):
+        pads = mx.array([1])[:, None, None]
+        mask = _prefill_mask(pads, 2, 4)
+        self.assertEqual(mask.shape, (1, 1, 2, 4))
+        self.assertEqual(mask[0, 0].tolist(), [[False, True, True, False],
+                                               [False, True, True, True]])
+
+
+@unittest.skipUnless(MLX_LM_AVAILABLE, "mlx-lm is not installed")
+class CanBatchTest(unittest.TestCase):
+    def test_plain_kv_cache_model(self):
+        self.assertTrue(can_batch(_tiny_llama()))
+
+    def test_model_without_mask_argument(self):
+        class NoMask(nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.layers = [nn.Linear(2, 2)]
+
+            def __call__(self, inputs, cache=None):
+                return inputs
+
+        self.assertFalse(can_batch(NoMask()))
+
+    def test_sliding_window_cache(self):
+        model = _tiny_llama()
+        model.make_cache = lambda: [RotatingKVCache(max_size=16) for _ in model.layers]
+        self.assertFalse(can_batch(model))
+
+
+@unittest.skipUnless(MLX_LM_AVAILABLE, "mlx-lm is not installed")
+class BatchedDecodeTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.adapter = MLXAdapter()
+        self.adapter.model = _tiny_llama()
+        self.adapter.tokenizer = SimpleNamespace(
+            _tokenizer=None, _detokenizer_class=_Detokenizer, detokenizer=None, eos_token_ids=set()
+        )
+        self.scheduler = BatchScheduler(self.adapter)
+
+    async def asyncTearDown(self):
+        await self.adapter.aclose()
+
+    def _serial(self, prompt, max_tokens):
+        model = self.adapter.model
+        cache = make_prompt_cache(model)
+        logits = model(mx.array(prompt)[None], cache=cache)[:, -1, :]
+        tokens = []
+        while len(tokens) < max_tokens:
+            token = _greedy(logits)
+            tokens.append(token.item())
+            logits = model(token[:, None], cache=cache)[:, -1, :]
+        return tokens
+
+    async def _collect(self, prompt, max_tokens):
+        return [chunk async for chunk in self.scheduler.stream(prompt, _greedy, [], max_tokens, 4)]
+
+    async def test_batched_tokens_match_serial(self):
+        prompts = [[5, 17, 42, 8, 3, 61, 22], [9, 1], [30, 31, 32, 33]]
+        max_tokens = [6, 9, 4]
+        results = await asyncio.gather(*(self._collect(p, n) for p, n in zip(prompts, max_tokens)))
+        for prompt, n, chunks in zip(prompts, max_tokens, results):
+            self.assertEqual([c.token for c in chunks], self._serial(prompt, n))
+            self.assertEqual(chunks[-1].finish_reason, "length")
+            self.assertEqual(chunks[-1].generation_tokens, n)
+            self.assertEqual(chunks[0].prompt_tokens, len(prompt))
+
+    async def test_lone_request_is_handed_back(self):
+        self.assertEqual(await self._collect([1, 2, 3], 4), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+"""An encode still running when another model loads must not fill the new model's caches."""
+import unittest
+from collections import OrderedDict
+
+from mlxui.backend.core.mlx_adapter import MLXAdapter
+
+
+class EncodeCacheSwapTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.adapter = MLXAdapter()
+
+        async def encode(text, add_special_tokens=True):
+            # A model load finishing while the old tokenizer is still encoding.
+            self.adapter._encode_cache = OrderedDict()
+            self.adapter._template_cache = OrderedDict()
+            return [1, 2, 3]
+
+        self.adapter._batch_encoder.encode = encode
+
+    async def asyncTearDown(self):
+        await self.adapter.aclose()
+
+    async def test_encode_result_stays_out_of_new_cache(self):
+        old_cache = self.adapter._encode_cache
+        tokens = await self.adapter._encode("hello")
+        self.assertEqual(list(tokens), [1, 2, 3])
+        self.assertEqual(len(self.adapter._encode_cache), 0)
+        self.assertIn("hello", old_cache)
+
+    async def test_chat_result_stays_out_of_new_cache(self):
+        class Tokenizer:
+            def apply_chat_template(self, messages, tokenize, add_generation_prompt):
+                return "user: hi"
+
+        self.adapter.tokenizer = Tokenizer()
+        result = await self.adapter._encode_chat([{"role": "user", "content": "hi"}])
+        self.assertEqual(result[0], "user: hi")
+        self.assertEqual(len(self.adapter._template_cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Stored prompt cache snapshots must resume with the KV state of exactly the matched tokens."""
+import unittest
+from array import array
+from unittest import mock
+
+import mlx.core as mx
+
+from mlxui.backend.core import prefix_cache
+from mlxui.backend.core.mlx_adapter import MLX_LM_AVAILABLE
+from mlxui.backend.core.prefix_cache import PREFIX_CACHE_BLOCK_SIZE, PrefixCacheStore, common_token_prefix_len
+
+if MLX_LM_AVAILABLE:
+    from mlx_lm.models.cache import KVCache
+
+
+def _config(**overrides):
+    get = prefix_cache.app_config.get
+    settings = {"generation." + key: value for key, value in overrides.items()}
+    return mock.patch.object(
+        prefix_cache.app_config, "get", side_effect=lambda key, default=None: settings.get(key, get(key, default))
+    )
+
+
+class CommonTokenPrefixLenTest(unittest.TestCase):
+    def test_short_and_long_prefixes(self):
+        for n in (10, 1000):
+            cached = array("i", range(n))
+            new = list(range(n // 2)) + [-5] * n
+            self.assertEqual(common_token_prefix_len(cached, new), n // 2)
+            self.assertEqual(common_token_prefix_len(cached, list(range(n))), n)
+
+
+@unittest.skipUnless(MLX_LM_AVAILABLE, "mlx-lm is not installed")
+class PrefixCacheStoreTest(unittest.TestCase):
+    def setUp(self):
+        mx.random.seed(0)
+        self.store = PrefixCacheStore()
+        self.tokens = array("i", range(1000, 1000 + 2 * PREFIX_CACHE_BLOCK_SIZE + 40))
+        self.cache = []
+        for _ in range(2):
+            layer = KVCache()
+            n = len(self.tokens)
+            layer.update_and_fetch(mx.random.normal((1, 2, n, 64)), mx.random.normal((1, 2, n, 64)))
+            self.cache.append(layer)
+
+    def test_full_precision_roundtrip(self):
+        with _config(prefix_cache_kv_bits=0):
+            self.store.put(self.tokens, self.cache)
+        prompt = list(self.tokens[:300]) + [7, 8, 9]
+        matched, restored = self.store.match(prompt)
+        self.assertEqual(matched, 300)
+        for original, resumed in zip(self.cache, restored):
+            self.assertEqual(resumed.offset, 300)
+            self.assertTrue(mx.array_equal(resumed.state[0], original.keys[..., :300, :]))
+            self.assertTrue(mx.array_equal(resumed.state[1], original.values[..., :300, :]))
+
+    def test_quantized_roundtrip_is_close(self):
+        with _config(prefix_cache_kv_bits=8):
+            self.store.put(self.tokens, self.cache)
+        matched, restored = self.store.match(list(self.tokens))
+        self.assertEqual(matched, len(self.tokens))
+        error = mx.abs(restored[0].state[0] - self.cache[0].keys[..., : len(self.tokens), :]).max().item()
+        self.assertLess(error, 0.1)
+
+    def test_tags_and_short_matches_miss(self):
+        self.store.put(self.tokens, self.cache, tag="draft-a")
+        self.assertEqual(self.store.match(list(self.tokens), tag="draft-b"), (0, None))
+        self.assertEqual(self.store.match(list(self.tokens[:10]), tag="draft-a"), (0, None))
+
+    def test_eviction_keeps_the_shared_beginning(self):
+        self.store.put(self.tokens, self.cache)
+        self.assertEqual(len(self.store), 3)
+        self.store._evict(self.store._nbytes - 1)
+        self.assertEqual(len(self.store), 2)
+        matched, _ = self.store.match(list(self.tokens))
+        self.assertEqual(matched, 2 * PREFIX_CACHE_BLOCK_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Trimming the KV cache drops the most recent tokens, so the recorded IDs must lose their tail."""
+import unittest
+from array import array
+
+import mlx.core as mx
+
+from mlxui.backend.core.mlx_adapter import MLXAdapter, MLX_LM_AVAILABLE
+
+if MLX_LM_AVAILABLE:
+    from mlx_lm.models.cache import KVCache
+
+
+@unittest.skipUnless(MLX_LM_AVAILABLE, "mlx-lm is not installed")
+class TrimKVCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.adapter = MLXAdapter()
+        # trim_kv_cache only checks that a model is loaded; it never calls it.
+        self.adapter.model = object()
+        self.adapter.tokenizer = object()
+        layer = KVCache()
+        layer.update_and_fetch(mx.zeros((1, 2, 10, 8)), mx.zeros((1, 2, 10, 8)))
+        self.adapter.prompt_cache = [layer]
+        self.adapter.prompt_cache_tokens = array("i", range(100, 110))
+
+    async def asyncTearDown(self):
+        await self.adapter.aclose()
+
+    async def test_trim_keeps_leading_token_ids(self):
+        ok, _, cache_size = await self.adapter.trim_kv_cache(3)
+        self.assertTrue(ok)
+        self.assertEqual(cache_size, 7)
+        self.assertEqual(self.adapter.prompt_cache_tokens, array("i", range(100, 107)))
+        self.assertEqual(self.adapter.prompt_cache[0].offset, 7)
+
+    async def test_diverging_prompt_keeps_shared_prefix(self):
+        tail = await self.adapter._update_prompt_cache([100, 101, 102, 7, 8])
+        self.assertEqual(tail, array("i", [7, 8]))
+        self.assertEqual(self.adapter.prompt_cache[0].offset, 3)
+        self.assertEqual(self.adapter.prompt_cache_tokens, array("i", [100, 101, 102, 7, 8]))
+
+
+if __name__ == "__main__":
+    unittest.main()